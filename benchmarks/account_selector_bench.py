@@ -0,0 +1,81 @@
+'''
+	Measures per-job AccountSelector overhead of download worker.
+	Former Manager proxy based state is reproduced with the same access pattern.
+	Usage: python benchmarks/account_selector_bench.py [jobs_amount]
+'''
+import os
+import sys
+import json
+import uuid
+import timeit
+import tempfile
+import multiprocessing
+import multiprocessing.managers
+
+from warp_beacon.jobs import Origin
+from warp_beacon.scraper.account_selector import AccountSelector
+
+ACCOUNTS = {
+	"instagram": [{"login": f"user{i}", "proxy_id": "ig"} for i in range(4)],
+	"youtube": [{"login": "yt", "proxy_id": "yt"}]
+}
+
+PROXIES = [{"id": "ig", "dsn": f"socks5://127.0.0.{i}:1080", "ip_version": "both"} for i in range(1, 4)]
+
+def build_selector(tmp_dir: str) -> AccountSelector:
+	acc_file, proxy_file = os.path.join(tmp_dir, "accounts.json"), os.path.join(tmp_dir, "proxies.json")
+	with open(acc_file, "w", encoding="utf-8") as f:
+		json.dump(ACCOUNTS, f)
+	with open(proxy_file, "w", encoding="utf-8") as f:
+		json.dump(PROXIES, f)
+	AccountSelector.session_dir = tmp_dir
+	return AccountSelector(acc_file, proxy_file)
+
+def selector_job(selector: AccountSelector) -> None:
+	# calls made by AsyncDownloader.do_work for a single Instagram job
+	selector.count_service_accounts(Origin.INSTAGRAM)
+	selector.get_last_proxy()
+	selector.set_module(Origin.INSTAGRAM)
+	selector.get_current_proxy()
+	selector.get_ig_request_count()
+	selector.get_ig_session_id()
+	selector.get_current()
+	selector.inc_ig_request_count()
+
+class ManagerState(object):
+	def __init__(self, manager: multiprocessing.managers.SyncManager) -> None:
+		self.lock = manager.Lock()
+		self.account_index = {"instagram": manager.Value('i', 0), "youtube": manager.Value('i', 0)}
+		self.ig_request_count = manager.Value('i', 0)
+		self.meta_data = manager.dict()
+		self.sessions = manager.dict()
+
+def manager_job(state: ManagerState) -> None:
+	# same shared state accesses as selector_job, each one is an IPC round trip
+	state.meta_data.get("last_proxy", None)
+	state.account_index["instagram"].value
+	state.account_index["instagram"].value
+	state.meta_data.get("last_proxy", None)
+	state.meta_data["last_proxy"] = PROXIES[0]
+	state.ig_request_count.value
+	with state.lock:
+		idx = state.account_index["instagram"].value
+		if idx not in state.sessions:
+			state.sessions[idx] = str(uuid.uuid4())
+		state.sessions[idx]
+	state.account_index["instagram"].value
+	state.ig_request_count.value += 1
+
+def main() -> None:
+	jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		selector = build_selector(tmp_dir)
+		with multiprocessing.Manager() as manager:
+			state = ManagerState(manager)
+			print(f"jobs: {jobs}")
+			for name, func in (("manager", lambda: manager_job(state)), ("shared", lambda: selector_job(selector))):
+				best = min(timeit.repeat(func, number=jobs, repeat=5))
+				print(f"{name:>8}: {best * 1000:.2f} ms total, {best / jobs * 1e6:.2f} us per job")
+
+if __name__ == "__main__":
+	main()
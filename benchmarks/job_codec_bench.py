@@ -0,0 +1,96 @@
+'''
+	Compares per-job IPC cost of the former __dict__ based job model with slotted jobs.
+	Legacy model is reproduced here, it pickled every job with enums and UUID objects.
+	Usage: python benchmarks/job_codec_bench.py [iterations]
+'''
+import sys
+import copy
+import uuid
+import pickle
+import timeit
+
+from pyrogram.enums import ChatType
+
+from warp_beacon.jobs import Origin
+from warp_beacon.jobs.types import JobType
+from warp_beacon.jobs.abstract import JOB_SCHEMA
+from warp_beacon.jobs.codec import JobCodec
+from warp_beacon.jobs.download_job import DownloadJob
+
+class LegacyJob(object):
+	def __init__(self, **kwargs) -> None:
+		if kwargs:
+			self.__dict__.update(kwargs)
+		self.job_id = uuid.uuid4()
+
+	def to_dict(self) -> dict:
+		d = {}
+		for key in dir(self.__class__):
+			if not key.startswith('_'):
+				value = getattr(self, key)
+				if not callable(value):
+					d[key] = value
+		return d
+
+	def to_upload_job(self, **kwargs) -> "LegacyJob":
+		d = self.to_dict()
+		d.update(copy.deepcopy(kwargs))
+		if "media_collection" in d:
+			for index, _ in enumerate(d["media_collection"]):
+				for k, _ in enumerate(d["media_collection"][index]):
+					d["media_collection"][index][k] = LegacyJob(**d["media_collection"][index][k])
+		return LegacyJob(**d)
+
+for _name, _default in JOB_SCHEMA:
+	setattr(LegacyJob, _name, _default)
+
+JOB_ARGS = {
+	"url": "https://www.instagram.com/reel/C9x3YzKt1aB/",
+	"message_id": 4242,
+	"chat_id": -1001234567890,
+	"user_id": 123456789,
+	"placeholder_message_id": 4243,
+	"uniq_id": "0f343b0931126a20f133d67c2b018a3b",
+	"job_origin": Origin.INSTAGRAM,
+	"chat_type": ChatType.SUPERGROUP,
+	"message_leftover": "look at this"
+}
+
+UPLOAD_ARGS = {
+	"media_type": JobType.VIDEO,
+	"local_media_path": "/tmp/1718000000_123456.mp4",
+	"canonical_name": "Some reel",
+	"media_info": {"filesize": 4194304, "duration": 17.5, "width": 720, "height": 1280, "has_sound": True}
+}
+
+def roundtrip_legacy() -> LegacyJob:
+	job = LegacyJob(**JOB_ARGS)
+	job = pickle.loads(pickle.dumps(job))
+	upload_job = job.to_upload_job(**UPLOAD_ARGS)
+	return pickle.loads(pickle.dumps(upload_job))
+
+def roundtrip_slotted_pickle() -> DownloadJob:
+	job = DownloadJob.build(**JOB_ARGS)
+	job = pickle.loads(pickle.dumps(job))
+	upload_job = job.to_upload_job(**UPLOAD_ARGS)
+	return pickle.loads(pickle.dumps(upload_job))
+
+def roundtrip_codec() -> DownloadJob:
+	job = DownloadJob.build(**JOB_ARGS)
+	job = JobCodec.decode(JobCodec.encode(job))
+	upload_job = job.to_upload_job(**UPLOAD_ARGS)
+	return JobCodec.decode(JobCodec.encode(upload_job))
+
+def main() -> None:
+	iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+	upload_legacy = LegacyJob(**JOB_ARGS).to_upload_job(**UPLOAD_ARGS)
+	upload_slotted = DownloadJob.build(**JOB_ARGS).to_upload_job(**UPLOAD_ARGS)
+	print(f"iterations: {iterations}")
+	print(f"upload job size: legacy pickle={len(pickle.dumps(upload_legacy))} B"
+		f" slotted pickle={len(pickle.dumps(upload_slotted))} B codec={len(JobCodec.encode(upload_slotted))} B")
+	for name, func in (("legacy", roundtrip_legacy), ("pickle", roundtrip_slotted_pickle), ("codec", roundtrip_codec)):
+		best = min(timeit.repeat(func, number=iterations, repeat=5))
+		print(f"{name:>8}: {best * 1000:.2f} ms total, {best / iterations * 1e6:.2f} us per job lifecycle")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,76 @@
+'''
+	Compares URLExtract based link handling with UrlMatcher fast path.
+	Usage: python benchmarks/url_matcher_bench.py [messages_amount] [links_share]
+'''
+import sys
+import random
+import timeit
+
+from urlextract import URLExtract
+
+from warp_beacon.jobs import Origin
+from warp_beacon.storage import Storage
+from warp_beacon.telegram.utils import Utils
+from warp_beacon.telegram.url_matcher import UrlMatcher
+
+CHATTER = [
+	"hi all, who is going to the meetup tomorrow?",
+	"lol that was hilarious",
+	"can someone send me the docs for the new release",
+	"I think we should move the deadline to friday, what do you think guys?",
+	"ok",
+	"check google.com/search?q=weather before you go out",
+	"the build is green again 🎉"
+]
+
+LINKS = [
+	"https://www.instagram.com/reel/C9x3YzKt1aB/?igsh=MWQ1ZGUxMzBkMA==",
+	"look at this https://youtube.com/shorts/dQw4w9WgXcQ?si=abc",
+	"https://music.youtube.com/watch?v=dQw4w9WgXcQ&list=RDAMVM",
+	"https://x.com/someone/status/1790000000000000000 wow",
+	"https://youtu.be/dQw4w9WgXcQ?si=xyz"
+]
+
+def build_corpus(amount: int, links_share: float) -> list[str]:
+	rnd = random.Random(42)
+	return [rnd.choice(LINKS) if rnd.random() < links_share else rnd.choice(CHATTER) for _ in range(amount)]
+
+def current_path(extractor: URLExtract, corpus: list[str]) -> int:
+	found = 0
+	for text in corpus:
+		urls_raw = extractor.find_urls(text)
+		if not urls_raw:
+			continue
+		Utils.compute_leftover(urls_raw, text)
+		for url in Utils.remove_links_wo_paths(list(set(urls_raw))):
+			if Utils.extract_origin(url) is Origin.UNKNOWN:
+				continue
+			Storage.compute_uniq(url)
+			found += 1
+	return found
+
+def fast_path(corpus: list[str]) -> int:
+	found = 0
+	for text in corpus:
+		if not UrlMatcher.has_supported_url(text):
+			continue
+		urls = UrlMatcher.extract(text)
+		Utils.compute_leftover([url for url, _ in urls], text)
+		for url, _ in urls:
+			Storage.compute_uniq(url)
+			found += 1
+	return found
+
+def main() -> None:
+	amount = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+	links_share = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+	corpus = build_corpus(amount, links_share)
+	extractor = URLExtract()
+	print(f"messages: {amount}, links share: {links_share:.2%}")
+	print(f"links found: current={current_path(extractor, corpus)} fast={fast_path(corpus)}")
+	for name, func in (("current", lambda: current_path(extractor, corpus)), ("fast", lambda: fast_path(corpus))):
+		best = min(timeit.repeat(func, number=1, repeat=5))
+		print(f"{name:>8}: {best * 1000:.2f} ms total, {best / amount * 1e6:.2f} us per message")
+
+if __name__ == "__main__":
+	main()
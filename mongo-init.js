@@ -6,4 +6,14 @@ db.media.createIndex(
 		"tg_file_id": "text",
 		"media_type": "text"
 	}
+)
+db.media.createIndex(
+	{
+		"uniq_id": 1,
+		"origin": 1
+	},
+	{
+		"unique": true,
+		"name": "uniq_id_origin"
+	}
 )
\ No newline at end of file
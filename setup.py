@@ -68,14 +68,21 @@ setup(
 		"warp_beacon/telegram/utils",
 		"warp_beacon/telegram/caption_shortener",
 		"warp_beacon/telegram/progress_bar",
+		"warp_beacon/telegram/progress_aggregator",
 		"warp_beacon/telegram/progress_file_reader",
 		"warp_beacon/telegram/edit_message",
+		"warp_beacon/telegram/upload_engine",
+		"warp_beacon/telegram/upload_shards",
+		"warp_beacon/telegram/send_scheduler",
 		"warp_beacon/telegram/download_status",
 		"warp_beacon/telegram/custom_handlers",
 		"warp_beacon/telegram/types",
+		"warp_beacon/telegram/url_matcher",
+		"warp_beacon/telegram/chat_members_cache",
 		"warp_beacon/jobs/abstract",
 		"warp_beacon/jobs/download_job",
 		"warp_beacon/jobs/upload_job",
+		"warp_beacon/jobs/codec",
 		"warp_beacon/mediainfo/abstract",
 		"warp_beacon/mediainfo/video",
 		"warp_beacon/mediainfo/audio",
@@ -83,6 +90,7 @@ setup(
 		"warp_beacon/compress/video",
 		"warp_beacon/scheduler/scheduler",
 		"warp_beacon/scheduler/instagram_human",
+		"warp_beacon/scheduler/fair_queue",
 		"warp_beacon/scraper/abstract",
 		"warp_beacon/scraper/exceptions",
 		"warp_beacon/scraper/types",
@@ -97,9 +105,19 @@ setup(
 		"warp_beacon/scraper/X/X",
 		"warp_beacon/scraper/X/types",
 		"warp_beacon/scraper/fail_handler",
+		"warp_beacon/scraper/lanes",
+		"warp_beacon/scraper/delay_queue",
+		"warp_beacon/scraper/autoscaler",
+		"warp_beacon/scraper/origin_limits",
 		"warp_beacon/scraper/link_resolver",
 		"warp_beacon/scraper/utils",
-		"warp_beacon/storage/mongo"
+		"warp_beacon/storage/mongo",
+		"warp_beacon/storage/async_storage",
+		"warp_beacon/storage/cache",
+		"warp_beacon/storage/bloom",
+		"warp_beacon/storage/journal",
+		"warp_beacon/uploader/notifier",
+		"warp_beacon/uploader/channel"
 	],
 	#scripts=['scripts/wait_dc_update.py'],
 	data_files=[
@@ -21,12 +21,12 @@ class JobSettings(TypedDict):
 	url: str
 	uniq_id: str
 	tg_file_id: str
-	in_process: bool
 	media_type: JobType
 	job_failed: bool
 	job_failed_msg: str
 	job_warning: bool
 	job_warning_message: str
+	job_warning_msg: str
 	effective_url: str
 	save_items: bool
 	media_collection: list
@@ -49,53 +49,100 @@ class JobSettings(TypedDict):
 	short_text: bool
 	scroll_content: bool
 	last_pk: int
+	failed_job_replay: bool
+
+# explicit job schema, order is a part of the serialized state format
+JOB_SCHEMA = (
+	("job_id", None),
+	("message_id", 0),
+	("user_id", 0),
+	("chat_id", 0),
+	("placeholder_message_id", 0),
+	("local_media_path", ""),
+	("local_compressed_media_path", ""),
+	("media_info", {}),
+	("url", ""),
+	("uniq_id", ""),
+	("tg_file_id", ""),
+	("media_type", JobType.VIDEO),
+	# unused, holds position in state of jobs stored in journal and failed jobs store
+	("in_process", False),
+	("job_warning", False),
+	("job_warning_message", ""),
+	("job_warning_msg", ""),
+	("job_failed", False),
+	("job_failed_msg", ""),
+	("effective_url", ""),
+	("save_items", False),
+	("media_collection", []),
+	("job_origin", Origin.UNKNOWN),
+	("canonical_name", ""),
+	("is_message_to_admin", False),
+	("message_text", ""),
+	("source_username", ""),
+	("unvailable_error_count", 0),
+	("geoblock_error_count", 0),
+	("account_switches", 0),
+	("bad_proxy_error_count", 0),
+	("yt_auth", False),
+	("session_validation", False),
+	("chat_type", None),
+	("account_admins", None),
+	("job_postponed_until", -1),
+	("message_leftover", ""),
+	("replay", False),
+	("short_text", False),
+	("scroll_content", False),
+	("last_pk", 0),
+	("failed_job_replay", False)
+)
+JOB_FIELDS = tuple(name for name, _ in JOB_SCHEMA)
+JOB_FIELDS_SET = frozenset(JOB_FIELDS)
+# mutable defaults must not be shared between jobs
+JOB_MUTABLE_DEFAULTS = tuple((name, default.__class__) for name, default in JOB_SCHEMA if default.__class__ in (dict, list))
+# fields converted to plain values in serialized state
+JOB_STATE_CONVERTERS = {
+	"job_id": (lambda value: value.bytes, lambda value: uuid.UUID(bytes=value)),
+	"media_type": (lambda value: JobType(value).value, JobType),
+	"job_origin": (lambda value: value.value, Origin),
+	"chat_type": (lambda value: value.name, lambda value: ChatType[value])
+}
+JOB_STATE_CONVERTERS_INDEXED = tuple((JOB_FIELDS.index(name), pack, unpack) for name, (pack, unpack) in JOB_STATE_CONVERTERS.items())
 
 class AbstractJob(ABC):
-	job_id: uuid.UUID = None
-	message_id: int = 0
-	user_id: int = 0
-	chat_id: int = 0
-	placeholder_message_id: int = 0
-	local_media_path: str = ""
-	local_compressed_media_path: str = ""
-	media_info: dict = {}
-	url: str = ""
-	uniq_id: str = ""
-	tg_file_id: str = ""
-	media_type: JobType = JobType.VIDEO
-	in_process: bool = False
-	job_warning: bool = False
-	job_warning_message: str = ""
-	job_failed: bool = False
-	job_failed_msg: str = ""
-	effective_url: str = ""
-	save_items: bool = False
-	media_collection: list = []
-	job_origin: Origin = Origin.UNKNOWN
-	canonical_name: str = ""
-	is_message_to_admin: bool = False
-	message_text: str = ""
-	source_username: str = ""
-	unvailable_error_count: int = 0
-	geoblock_error_count: int = 0
-	account_switches: int = 0
-	bad_proxy_error_count: int = 0
-	yt_auth: bool = False
-	session_validation: bool = False
-	chat_type: ChatType = None
-	account_admins: str = None
-	job_postponed_until: int = -1
-	message_leftover: str = ""
-	replay: bool = False
-	short_text: bool = False
-	scroll_content: bool = False
-	last_pk: int = 0
+	__slots__ = JOB_FIELDS
 
 	def __init__(self, **kwargs: Unpack[JobSettings]) -> None:
-		if kwargs:
-			self.__dict__.update(kwargs)
+		get = kwargs.get
+		for name, default in JOB_SCHEMA:
+			setattr(self, name, get(name, default))
+		for name, factory in JOB_MUTABLE_DEFAULTS:
+			if name not in kwargs:
+				setattr(self, name, factory())
 		self.job_id = uuid.uuid4()
 
+	def __getstate__(self) -> list:
+		state = [getattr(self, name) for name in JOB_FIELDS]
+		for index, pack, _ in JOB_STATE_CONVERTERS_INDEXED:
+			if state[index] is not None:
+				state[index] = pack(state[index])
+		return state
+
+	def __setstate__(self, state: list) -> None:
+		if isinstance(state, dict):
+			# pickled by former __dict__ based model, e.g. stored failed jobs
+			self.__init__(**state)
+			self.job_id = state.get("job_id", self.job_id)
+			return
+		if len(state) < len(JOB_FIELDS):
+			# stored before trailing fields were added to schema
+			state = state + [default for _, default in JOB_SCHEMA[len(state):]]
+		for index, _, unpack in JOB_STATE_CONVERTERS_INDEXED:
+			if state[index] is not None:
+				state[index] = unpack(state[index])
+		for name, value in zip(JOB_FIELDS, state):
+			setattr(self, name, value)
+
 	def __del__(self) -> None:
 		pass
 
@@ -117,14 +164,13 @@ class AbstractJob(ABC):
 		return False
 
 	def to_dict(self) -> dict:
-		d = {}
-		for key in dir(self.__class__):
-			if not key.startswith('_'):
-				value = getattr(self, key)
-				if not callable(value):
-					d[key] = value
-					
-		return d
+		return {name: getattr(self, name) for name in JOB_FIELDS}
+
+	@staticmethod
+	def remove_thumbnail(media_info: dict) -> None:
+		thumb = media_info.get("thumb", None) if media_info else None
+		if isinstance(thumb, str) and os.path.exists(thumb):
+			os.unlink(thumb)
 
 	def remove_files(self) -> bool:
 		if self.media_type == JobType.COLLECTION:
@@ -132,11 +178,13 @@ class AbstractJob(ABC):
 				for j in i:
 					if os.path.exists(j.local_media_path):
 						os.unlink(j.local_media_path)
+					AbstractJob.remove_thumbnail(j.media_info)
 		elif self.media_type == JobType.TEXT:
 			pass
 		else:
 			if os.path.exists(self.local_media_path):
 				os.unlink(self.local_media_path)
+			AbstractJob.remove_thumbnail(self.media_info)
 			if self.local_compressed_media_path:
 				if os.path.exists(self.local_compressed_media_path):
 					os.unlink(self.local_compressed_media_path)
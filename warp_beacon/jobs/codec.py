@@ -0,0 +1,54 @@
+import pickle
+
+import msgpack
+
+from warp_beacon.jobs.abstract import AbstractJob, JOB_FIELDS
+from warp_beacon.jobs.download_job import DownloadJob
+from warp_beacon.jobs.upload_job import UploadJob
+
+class JobCodec(object):
+	'''
+		Compact binary job representation for IPC queues.
+		Job state is a msgpack array in schema order, values msgpack can't express
+		(e.g. third party objects in media info) are embedded as pickled extension type.
+	'''
+	JOB_CLASSES = (DownloadJob, UploadJob)
+	JOB_CLASS_TAGS = {cls: tag for tag, cls in enumerate(JOB_CLASSES)}
+	MEDIA_COLLECTION_INDEX = JOB_FIELDS.index("media_collection")
+	EXT_PICKLE = 1
+
+	@staticmethod
+	def default(obj: object) -> msgpack.ExtType:
+		return msgpack.ExtType(JobCodec.EXT_PICKLE, pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+	@staticmethod
+	def ext_hook(code: int, data: bytes) -> object:
+		if code == JobCodec.EXT_PICKLE:
+			return pickle.loads(data)
+		return msgpack.ExtType(code, data)
+
+	@staticmethod
+	def pack_job(job: AbstractJob) -> list:
+		state = job.__getstate__()
+		collection = state[JobCodec.MEDIA_COLLECTION_INDEX]
+		if collection:
+			state[JobCodec.MEDIA_COLLECTION_INDEX] = [[JobCodec.pack_job(v) for v in chunk] for chunk in collection]
+		return [JobCodec.JOB_CLASS_TAGS[job.__class__], state]
+
+	@staticmethod
+	def unpack_job(packed: list) -> AbstractJob:
+		tag, state = packed
+		collection = state[JobCodec.MEDIA_COLLECTION_INDEX]
+		if collection:
+			state[JobCodec.MEDIA_COLLECTION_INDEX] = [[JobCodec.unpack_job(v) for v in chunk] for chunk in collection]
+		job = JobCodec.JOB_CLASSES[tag].__new__(JobCodec.JOB_CLASSES[tag])
+		job.__setstate__(state)
+		return job
+
+	@staticmethod
+	def encode(job: AbstractJob) -> bytes:
+		return msgpack.packb(JobCodec.pack_job(job), default=JobCodec.default, use_bin_type=True)
+
+	@staticmethod
+	def decode(data: bytes) -> AbstractJob:
+		return JobCodec.unpack_job(msgpack.unpackb(data, ext_hook=JobCodec.ext_hook, raw=False, strict_map_key=False))
@@ -1,5 +1,4 @@
 #from typing import TypedDict
-import copy
 from typing_extensions import Unpack
 
 from warp_beacon.jobs.upload_job import UploadJob
@@ -8,6 +7,8 @@ from warp_beacon.jobs.abstract import AbstractJob, JobSettings
 #import logging
 
 class DownloadJob(AbstractJob):
+	__slots__ = ()
+
 	def __init__(self, **kwargs: Unpack[JobSettings]) -> None:
 		super(DownloadJob, self).__init__(**kwargs)
 
@@ -17,9 +18,10 @@ class DownloadJob(AbstractJob):
 	
 	def to_upload_job(self, **kwargs: Unpack[JobSettings]) -> AbstractJob:
 		d = self.to_dict()
-		d.update(copy.deepcopy(kwargs))
-		if "media_collection" in d:
-			for index, _ in enumerate(d["media_collection"]):
-				for k, _ in enumerate(d["media_collection"][index]):
-					d["media_collection"][index][k] = UploadJob.build(**d["media_collection"][index][k])
+		d.update(kwargs)
+		if d["media_collection"]:
+			# scrapers pass collection items as dicts, build new lists instead of mutating them
+			d["media_collection"] = [
+				[UploadJob.build(**v) if isinstance(v, dict) else v for v in chunk] for chunk in d["media_collection"]
+			]
 		return UploadJob.build(**d)
\ No newline at end of file
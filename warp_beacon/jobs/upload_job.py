@@ -1,9 +1,11 @@
 from typing import TypedDict
 from typing_extensions import Unpack
 
-from warp_beacon.jobs.abstract import AbstractJob, JobSettings
+from warp_beacon.jobs.abstract import AbstractJob, JobSettings, JOB_FIELDS_SET
 
 class UploadJob(AbstractJob):
+	__slots__ = ()
+
 	def __init__(self, **kwargs: Unpack[JobSettings]) -> None:
 		super(UploadJob, self).__init__(**kwargs)
 
@@ -21,7 +23,7 @@ class UploadJob(AbstractJob):
 		return DownloadJob.build(**d)
 	
 	def set_flag(self, key: str, value: bool) -> "UploadJob":
-		if key in self.__dict__:
-			self.__dict__[key] = value
+		if key in JOB_FIELDS_SET:
+			setattr(self, key, value)
 
 		return self
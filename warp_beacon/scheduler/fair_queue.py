@@ -0,0 +1,185 @@
+import os
+import time
+import threading
+from collections import deque
+
+import logging
+
+from warp_beacon.jobs.download_job import DownloadJob
+
+class TokenBucket(object):
+	def __init__(self, rate: float, burst: int) -> None:
+		# rate in tokens per second
+		self.rate = rate
+		self.burst = burst
+		self.tokens = float(burst)
+		self.updated = time.monotonic()
+
+	def refill(self, now: float) -> None:
+		self.tokens = min(float(self.burst), self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def wait_time(self, now: float) -> float:
+		self.refill(now)
+		if self.tokens >= 1:
+			return 0.0
+		return (1 - self.tokens) / self.rate
+
+	def consume(self) -> None:
+		self.tokens -= 1
+
+	def is_full(self, now: float) -> bool:
+		self.refill(now)
+		return self.tokens >= self.burst
+
+class Flow(object):
+	def __init__(self, chat_id: int, user_id: int, weight: float) -> None:
+		self.chat_id = chat_id
+		self.user_id = user_id
+		self.weight = weight
+		self.last_finish = 0.0
+		# (finish_tag, job, lane)
+		self.jobs = deque()
+
+class FairQueue(object):
+	'''
+		Weighted fair queuing of user download jobs between chats and users.
+		Every (chat, user) pair is a separate flow, jobs are dispatched to download workers
+		in order of virtual finish time if chat and user token buckets allow it.
+		Light and heavy download lanes are throttled independently.
+	'''
+	LANE_POLL_INTERVAL = 0.2
+
+	def __init__(self, downloader: "AsyncDownloader") -> None:
+		self.downloader = downloader
+		self.chat_rate = float(os.environ.get("FAIR_QUEUE_CHAT_RATE", default=20)) / 60
+		self.chat_burst = int(os.environ.get("FAIR_QUEUE_CHAT_BURST", default=10))
+		self.user_rate = float(os.environ.get("FAIR_QUEUE_USER_RATE", default=10)) / 60
+		self.user_burst = int(os.environ.get("FAIR_QUEUE_USER_BURST", default=5))
+		self.prefetch = int(os.environ.get("FAIR_QUEUE_PREFETCH", default=1))
+		self.chat_weights = self.parse_weights(os.environ.get("FAIR_QUEUE_CHAT_WEIGHTS", default=""))
+		self.flows = {}
+		self.chat_buckets = {}
+		self.user_buckets = {}
+		self.virtual_time = 0.0
+		self.cond = threading.Condition()
+		self.running = False
+		self.thread = None
+
+	@staticmethod
+	def parse_weights(raw: str) -> dict:
+		'''
+			Format: "chat_id:weight,chat_id:weight"
+		'''
+		weights = {}
+		for item in raw.split(','):
+			if ':' in item:
+				chat_id, weight = item.rsplit(':', 1)
+				try:
+					weights[int(chat_id.strip())] = max(0.01, float(weight))
+				except ValueError:
+					logging.warning("Bad fair queue weight '%s'", item)
+		return weights
+
+	def start(self) -> None:
+		self.running = True
+		self.thread = threading.Thread(target=self.do_work)
+		self.thread.start()
+
+	def stop(self) -> None:
+		with self.cond:
+			self.running = False
+			self.cond.notify_all()
+		if self.thread:
+			self.thread.join()
+			self.thread = None
+
+	def submit(self, job: DownloadJob) -> int:
+		'''
+			Returns amount of queued jobs which will be dispatched before this one.
+		'''
+		# classifier must not be called under lock, dispatcher thread waits on it
+		lane = self.downloader.classify(job)
+		with self.cond:
+			key = (job.chat_id, job.user_id)
+			flow = self.flows.get(key, None)
+			if flow is None:
+				flow = Flow(job.chat_id, job.user_id, self.chat_weights.get(job.chat_id, 1.0))
+				self.flows[key] = flow
+			finish_tag = max(self.virtual_time, flow.last_finish) + 1 / flow.weight
+			flow.last_finish = finish_tag
+			flow.jobs.append((finish_tag, job, lane))
+			position = sum(1 for f in self.flows.values() for tag, _, queued_lane in f.jobs if tag < finish_tag and queued_lane is lane)
+			self.cond.notify_all()
+		return position
+
+	def size(self) -> int:
+		with self.cond:
+			return sum(len(f.jobs) for f in self.flows.values())
+
+	def get_bucket(self, buckets: dict, key: int, rate: float, burst: int) -> TokenBucket:
+		bucket = buckets.get(key, None)
+		if bucket is None:
+			bucket = TokenBucket(rate, burst)
+			buckets[key] = bucket
+		return bucket
+
+	def pick(self, now: float) -> tuple:
+		'''
+			Returns (job, lane, wait_time). Job is None if nothing is eligible right now.
+		'''
+		best, wait_time = None, None
+		busy_lanes = {}
+		for flow in self.flows.values():
+			if not flow.jobs:
+				continue
+			lane = flow.jobs[0][2]
+			# keep workers queues shallow, so new flows don't wait behind a burst
+			if lane not in busy_lanes:
+				busy_lanes[lane] = self.downloader.lane_qsize(lane) >= self.prefetch
+			if busy_lanes[lane]:
+				wait_time = self.LANE_POLL_INTERVAL if wait_time is None else min(wait_time, self.LANE_POLL_INTERVAL)
+				continue
+			chat_bucket = self.get_bucket(self.chat_buckets, flow.chat_id, self.chat_rate, self.chat_burst)
+			user_bucket = self.get_bucket(self.user_buckets, flow.user_id, self.user_rate, self.user_burst)
+			flow_wait = max(chat_bucket.wait_time(now), user_bucket.wait_time(now))
+			if flow_wait > 0:
+				wait_time = flow_wait if wait_time is None else min(wait_time, flow_wait)
+				continue
+			if best is None or flow.jobs[0][0] < best.jobs[0][0]:
+				best = flow
+		if best is None:
+			return None, None, wait_time
+		finish_tag, job, lane = best.jobs.popleft()
+		self.virtual_time = max(self.virtual_time, finish_tag)
+		self.chat_buckets[best.chat_id].consume()
+		self.user_buckets[best.user_id].consume()
+		return job, lane, 0.0
+
+	def cleanup(self, now: float) -> None:
+		for key in [k for k, f in self.flows.items() if not f.jobs]:
+			del self.flows[key]
+		for buckets in (self.chat_buckets, self.user_buckets):
+			for key in [k for k, b in buckets.items() if b.is_full(now)]:
+				del buckets[key]
+
+	def do_work(self) -> None:
+		logging.info("Fair queue thread started")
+		while self.running:
+			try:
+				with self.cond:
+					if not any(f.jobs for f in self.flows.values()):
+						self.cleanup(time.monotonic())
+						self.cond.wait()
+						continue
+					job, lane, wait_time = self.pick(time.monotonic())
+					if job is None:
+						self.cond.wait(timeout=wait_time)
+						continue
+				logging.info("Dispatching job '%s' of chat '%s' to '%s' download lane", job.url, job.chat_id, lane.value)
+				self.downloader.queue_task(job, lane=lane)
+			except Exception as e:
+				logging.error("Exception occurred inside fair queue thread!")
+				logging.exception(e)
+				time.sleep(1)
+		logging.info("Fair queue thread done")
@@ -1,6 +1,5 @@
 import logging
 import multiprocessing
-import multiprocessing.connection
 import os
 import socket
 import pathlib
@@ -17,13 +16,14 @@ if TYPE_CHECKING:
 	from multiprocessing.synchronize import Event as EventType
 
 from warp_beacon.scraper.account_selector import AccountSelector
+from warp_beacon.uploader.channel import ProcessChannel
 
 class ScraperAbstract(ABC):
 	def __init__(self, account: tuple, proxy: dict = None) -> None:
 		self.original_gai_family = None
 		self.send_message_to_admin_func: Callable = lambda: None
 		self.request_yt_auth: Callable = lambda: None
-		self.status_pipe: multiprocessing.connection.Connection = None
+		self.status_pipe: ProcessChannel = None
 		self.yt_validate_event: EventType = None
 		self.auth_event = None
 		self.acc_selector: AccountSelector = None
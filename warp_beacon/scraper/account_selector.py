@@ -10,46 +10,52 @@ from itertools import cycle
 import logging
 
 import multiprocessing
-import multiprocessing.managers
 
 from warp_beacon.jobs import Origin
 
 class AccountSelector(object):
+	'''
+		Account and proxy rotation state shared by download workers.
+		Shared state lives in raw shared memory created before workers fork,
+		reads are plain memory access and updates are guarded by one process shared lock.
+	'''
+	META_KEYS = ("auth_fails", "rate_limits", "captcha")
+	SESSION_ID_LEN = 36
 	accounts = None
 	proxies = None
 	current = None
 	current_module_name = None
 	accounts_meta_data = None
 	session_dir = "/var/warp_beacon"
-	manager = None
 	account_index = None
 	current_proxy = None
+	last_proxy_index = None
 	ig_request_count = None
 	ig_accounts_session_id = None
 	lock = None
 
-	def __init__(self, manager: multiprocessing.managers.SyncManager, acc_file_path: str, proxy_file_path: str=None) -> None:
+	def __init__(self, acc_file_path: str, proxy_file_path: str=None) -> None:
 		self.accounts = []
 		self.proxies = []
 		self.account_index = {}
-		self.manager = manager
-		self.lock = self.manager.Lock()
-		self.ig_accounts_session_id = self.manager.dict()
-		self.load_ig_sessions_id()
-		self.accounts_meta_data = self.manager.dict()
+		self.accounts_meta_data = {}
+		self.lock = multiprocessing.Lock()
+		self.ig_request_count = multiprocessing.RawValue('i', 0)
+		self.last_proxy_index = multiprocessing.RawValue('i', -1)
 		if os.path.exists(acc_file_path):
 			with open(acc_file_path, 'r', encoding="utf-8") as f:
 				self.accounts = json.loads(f.read())
 			if self.accounts:
-				self.ig_request_count = self.manager.Value('i', 0)
 				self.__init_meta_data()
 				#self.load_yt_sessions()
 				for acc_type, _ in self.accounts.items():
-					self.account_index[acc_type] = self.manager.Value('i', 0)
+					self.account_index[acc_type] = multiprocessing.RawValue('i', 0)
 			if proxy_file_path:
 				with open(proxy_file_path, 'r', encoding="utf-8") as f:
 					self.proxies = json.loads(f.read())
 
+			self.ig_accounts_session_id = multiprocessing.RawArray('c', self.SESSION_ID_LEN * max(1, len(self.accounts.get("instagram", []))))
+			self.load_ig_sessions_id()
 			self.load_ig_request_count()
 		else:
 			raise ValueError("Accounts file not found")
@@ -61,7 +67,11 @@ class AccountSelector(object):
 	def save_ig_sessions_id(self) -> None:
 		try:
 			with self.lock:
-				sessions = dict(self.ig_accounts_session_id)
+				sessions = {}
+				for idx in range(len(self.ig_accounts_session_id) // self.SESSION_ID_LEN):
+					session_id = self.read_session_id(idx)
+					if session_id:
+						sessions[idx] = session_id
 				logging.info("Saving sessions: %s", sessions)
 				with open(f"{self.session_dir}/ig_sessions_client_id.json", "w+", encoding="utf-8") as f:
 					json.dump(sessions, f, indent=2)
@@ -78,7 +88,7 @@ class AccountSelector(object):
 					data = json.loads(f.read())
 				if data and isinstance(data, dict):
 					for k, v in data.items():
-						self.ig_accounts_session_id[int(k)] = v
+						self.write_session_id(int(k), v)
 		except Exception as e:
 			logging.warning("Failed to read session ig_session_client_id!")
 			logging.exception(e)
@@ -105,11 +115,35 @@ class AccountSelector(object):
 			logging.error("Failed to save accounts states!")
 			logging.exception(e)
 
+	def read_session_id(self, idx: int) -> str:
+		offset = idx * self.SESSION_ID_LEN
+		if offset + self.SESSION_ID_LEN > len(self.ig_accounts_session_id):
+			return ""
+		return self.ig_accounts_session_id[offset:offset + self.SESSION_ID_LEN].rstrip(b'\x00').decode("ascii")
+
+	def write_session_id(self, idx: int, session_id: str) -> None:
+		offset = idx * self.SESSION_ID_LEN
+		raw = session_id.encode("ascii")
+		if offset + self.SESSION_ID_LEN > len(self.ig_accounts_session_id) or len(raw) != self.SESSION_ID_LEN:
+			logging.warning("Session id '%s' for account '%d' is not stored", session_id, idx)
+			return
+		self.ig_accounts_session_id[offset:offset + self.SESSION_ID_LEN] = raw
+
 	def get_current_proxy(self) -> Optional[dict]:
 		return self.current_proxy
 	
 	def get_last_proxy(self) -> Optional[dict]:
-		return self.accounts_meta_data.get("last_proxy", None)
+		idx = self.last_proxy_index.value
+		if 0 <= idx < len(self.proxies):
+			return self.proxies[idx]
+		return None
+
+	def set_last_proxy(self, proxy: dict) -> None:
+		# proxy dicts are the same in all workers, only the index is shared
+		for idx, candidate in enumerate(self.proxies):
+			if candidate is proxy or candidate == proxy:
+				self.last_proxy_index.value = idx
+				return
 
 	def get_proxy_list(self, ipv4: bool = False) -> List[dict]:
 		matched_proxy = []
@@ -145,7 +179,7 @@ class AccountSelector(object):
 							matched_proxy.remove(last_proxy)
 					prox_choice = random.choice(matched_proxy)
 					# saving chosen proxy for history
-					self.accounts_meta_data["last_proxy"] = prox_choice
+					self.set_last_proxy(prox_choice)
 					self.current_proxy = prox_choice
 					logging.info("Chosen proxy: '%s'", prox_choice)
 					return prox_choice
@@ -167,7 +201,7 @@ class AccountSelector(object):
 				if last_proxy and proxy.get("dsn", "") == last_proxy.get("dsn", ""):
 					proxy = next(lit)
 				self.current_proxy = proxy
-				self.accounts_meta_data["last_proxy"] = proxy
+				self.set_last_proxy(proxy)
 		except Exception as e:
 			logging.warning("Error on selection next proxy!")
 			logging.exception(e)
@@ -188,11 +222,9 @@ class AccountSelector(object):
 			self.accounts["youtube"].append({"session_file": "%s/yt_session_0.json" % self.session_dir, "index": 0})
 
 	def __init_meta_data(self) -> None:
+		# one row of META_KEYS counters per account
 		for module_name, lst in self.accounts.items():
-			if module_name not in self.accounts_meta_data:
-				self.accounts_meta_data[module_name] = []
-			for index, _ in enumerate(lst):
-				self.accounts_meta_data[module_name].insert(index, {"auth_fails": 0, "rate_limits": 0, "captcha": 0})
+			self.accounts_meta_data[module_name] = multiprocessing.RawArray('i', len(self.META_KEYS) * max(1, len(lst)))
 
 	def get_module_name(self, module_origin: Origin) -> str:
 		module_name = 'youtube' if next((s for s in ("yt", "youtube", "youtu_be") if s in module_origin.value), None) else 'instagram'
@@ -202,8 +234,9 @@ class AccountSelector(object):
 		module_name = self.get_module_name(module_origin)
 		self.current_module_name = module_name
 		if self.current is None:
-			idx = self.account_index[self.current_module_name].value
-			self.current = self.accounts[self.current_module_name][idx]
+			with self.lock:
+				idx = self.account_index[self.current_module_name].value
+				self.current = self.accounts[self.current_module_name][idx]
 			if not self.current.get("enabled", True):
 				logging.info("Account '%d' is disabled. Probing next ...", idx)
 				self.next()
@@ -213,35 +246,46 @@ class AccountSelector(object):
 		self.current_proxy = self.get_random_account_proxy(ipv4)
 
 	def next(self) -> dict:
-		idx = self.account_index[self.current_module_name].value
-		idx += 1
-		if idx >= len(self.accounts[self.current_module_name]):
-			idx = 0
-		self.account_index[self.current_module_name].value = idx
-		self.current = self.accounts[self.current_module_name][idx]
-		if not self.current.get("enabled", True):
-			logging.info("Account '%d' is disabled. Probing next ...", idx)
-			return self.next()
+		accounts = self.accounts[self.current_module_name]
+		with self.lock:
+			idx = self.account_index[self.current_module_name].value
+			# probe every account at most once, all of them may be disabled
+			for _ in range(len(accounts)):
+				idx += 1
+				if idx >= len(accounts):
+					idx = 0
+				if accounts[idx].get("enabled", True):
+					break
+				logging.info("Account '%d' is disabled. Probing next ...", idx)
+			self.account_index[self.current_module_name].value = idx
+			self.current = accounts[idx]
 		logging.info("Selected account index is '%d'", idx)
 		return self.current
 
+	def meta_offset(self, idx: int, key: str) -> int:
+		return idx * len(self.META_KEYS) + self.META_KEYS.index(key)
+
 	def bump_acc_fail(self, key: str, amount: int = 1) -> int:
 		try:
-			idx = self.account_index[self.current_module_name].value
-			meta_list = self.accounts_meta_data[self.current_module_name]
-			if idx >= len(meta_list):
-				logging.warning("Index '%d' out of range for module '%s' with length '%d'", idx, self.current_module_name, len(meta_list))
-				return 0
-			self.accounts_meta_data[self.current_module_name][idx][key] += amount
-			return meta_list[idx][key]
+			meta = self.accounts_meta_data[self.current_module_name]
+			accounts_count = len(meta) // len(self.META_KEYS)
+			with self.lock:
+				idx = self.account_index[self.current_module_name].value
+				if idx >= accounts_count:
+					logging.warning("Index '%d' out of range for module '%s' with length '%d'", idx, self.current_module_name, accounts_count)
+					return 0
+				offset = self.meta_offset(idx, key)
+				meta[offset] += amount
+				return meta[offset]
 		except Exception as e:
 			logging.warning("Failed to record fail stats")
 			logging.exception(e)
 		return 0
 
 	def how_much(self, key: str) -> int:
-		idx = self.account_index[self.current_module_name].value
-		return self.accounts_meta_data[self.current_module_name][idx][key]
+		with self.lock:
+			idx = self.account_index[self.current_module_name].value
+			return self.accounts_meta_data[self.current_module_name][self.meta_offset(idx, key)]
 
 	def get_current(self) -> tuple:
 		idx = self.account_index[self.current_module_name].value
@@ -254,7 +298,8 @@ class AccountSelector(object):
 
 	def get_meta_data(self) -> dict:
 		idx = self.account_index[self.current_module_name].value# - 1
-		return self.accounts_meta_data[self.current_module_name][idx]
+		meta = self.accounts_meta_data[self.current_module_name]
+		return {key: meta[self.meta_offset(idx, key)] for key in self.META_KEYS}
 
 	def count_service_accounts(self, mod_name: Origin) -> int:
 		module_name = 'youtube' if next((s for s in ("yt", "youtube", "youtu_be") if s in mod_name.value), None) else 'instagram'
@@ -263,10 +308,12 @@ class AccountSelector(object):
 		return len(self.accounts[module_name])
 	
 	def inc_ig_request_count(self, amount: int = 1) -> None:
-		self.ig_request_count.value += int(amount)
+		with self.lock:
+			self.ig_request_count.value += int(amount)
 
 	def reset_ig_request_count(self) -> None:
-		self.ig_request_count.value = 0
+		with self.lock:
+			self.ig_request_count.value = 0
 
 	def get_ig_request_count(self) -> int:
 		return int(self.ig_request_count.value)
@@ -274,17 +321,19 @@ class AccountSelector(object):
 	def get_ig_session_id(self) -> str:
 		with self.lock:
 			idx = int(self.account_index[self.current_module_name].value)
-			if idx not in self.ig_accounts_session_id:
-				self.ig_accounts_session_id[idx] = str(uuid.uuid4())
+			session_id = self.read_session_id(idx)
+			if not session_id:
+				session_id = str(uuid.uuid4())
+				self.write_session_id(idx, session_id)
 			#else:
 				#if random.random() > 0.95:
-				#	self.ig_accounts_session_id[idx] = str(uuid.uuid4())
+				#	self.write_session_id(idx, str(uuid.uuid4()))
 				#	logging.info("Rotated client_session_id — simulating app restart")
-			return self.ig_accounts_session_id[idx]
+			return session_id
 		
 	def generate_new_session_id(self) -> str:
 		with self.lock:
 			idx = self.account_index[self.current_module_name].value
 			session_id = str(uuid.uuid4())
-			self.ig_accounts_session_id[idx] = session_id
+			self.write_session_id(idx, session_id)
 			return session_id
\ No newline at end of file
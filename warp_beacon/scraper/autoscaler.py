@@ -0,0 +1,107 @@
+import os
+import time
+import asyncio
+
+import logging
+
+class WorkersAutoscaler(object):
+	'''
+		Grows and shrinks general download workers pool between configured bounds.
+		Pool grows when all workers are busy and jobs wait, shrinks after long idle period.
+		Reserved light workers are not managed.
+		Control task runs even with fixed pool: it reaps dead workers and logs origin limits stats.
+		It lives in the event loop, the same single control point which spawned initial workers,
+		so workers are never forked from helper threads.
+	'''
+	def __init__(self, downloader: "AsyncDownloader", min_workers: int, max_workers: int) -> None:
+		self.downloader = downloader
+		self.min_workers = max(1, min_workers)
+		self.max_workers = max(self.min_workers, max_workers)
+		self.interval = float(os.environ.get("WORKERS_SCALE_INTERVAL", default=5))
+		self.scale_up_wait = float(os.environ.get("WORKERS_SCALE_UP_WAIT", default=10))
+		self.scale_up_cooldown = float(os.environ.get("WORKERS_SCALE_UP_COOLDOWN", default=30))
+		self.scale_down_idle = float(os.environ.get("WORKERS_SCALE_DOWN_IDLE", default=600))
+		self.max_load = float(os.environ.get("WORKERS_MAX_LOAD", default=os.cpu_count() or 1))
+		self.stats_interval = float(os.environ.get("ORIGIN_STATS_LOG_INTERVAL", default=600))
+		self.last_stats = time.monotonic()
+		self.saturated_since = None
+		self.idle_since = None
+		self.last_scale_up = None
+		self.task = None
+
+	def is_enabled(self) -> bool:
+		return self.max_workers > self.min_workers
+
+	def start(self) -> None:
+		if self.is_enabled():
+			logging.info("Download workers autoscaling between '%d' and '%d' workers", self.min_workers, self.max_workers)
+		self.task = asyncio.get_running_loop().create_task(self.do_work())
+
+	def stop(self) -> None:
+		if self.task:
+			self.task.cancel()
+			self.task = None
+
+	def host_overloaded(self) -> bool:
+		try:
+			return os.getloadavg()[0] >= self.max_load
+		except OSError:
+			return False
+
+	def tick(self, now: float) -> None:
+		workers = self.downloader.reap_workers()
+		if self.stats_interval > 0 and now - self.last_stats >= self.stats_interval:
+			self.last_stats = now
+			logging.info("Origin concurrency stats: %s", self.downloader.origin_limits.stats())
+		if not self.is_enabled():
+			return
+		if self.downloader.retiring_workers.value > 0:
+			# wait until retired worker exits, queue depth includes its wakeup
+			return
+		backlog = self.downloader.backlog()
+		busy = self.downloader.busy_count()
+		# the longest wait since previous tick, reset so stale value never triggers scaling
+		queue_wait = self.downloader.queue_wait.value
+		self.downloader.queue_wait.value = 0.0
+
+		if backlog > 0 and busy >= workers:
+			self.idle_since = None
+			if self.saturated_since is None:
+				self.saturated_since = now
+			waited = max(now - self.saturated_since, queue_wait)
+			if self.last_scale_up is not None and now - self.last_scale_up < self.scale_up_cooldown:
+				return
+			if waited >= self.scale_up_wait and workers < self.max_workers:
+				if self.host_overloaded():
+					logging.info("Download workers saturated, but host load is too high to scale up")
+					return
+				logging.info("Scaling download workers up to '%d', backlog '%d', queue wait '%.1f' sec", workers + 1, backlog, queue_wait)
+				self.downloader.spawn_worker()
+				self.saturated_since = None
+				self.last_scale_up = now
+			return
+
+		self.saturated_since = None
+		if backlog == 0 and busy < workers:
+			if self.idle_since is None:
+				self.idle_since = now
+			if now - self.idle_since >= self.scale_down_idle and workers > self.min_workers:
+				logging.info("Scaling download workers down to '%d'", workers - 1)
+				self.downloader.retire_worker()
+				self.idle_since = now
+		else:
+			self.idle_since = None
+
+	async def do_work(self) -> None:
+		logging.info("Autoscaler task started")
+		try:
+			while True:
+				await asyncio.sleep(self.interval)
+				try:
+					self.tick(time.monotonic())
+				except Exception as e:
+					logging.error("Exception occurred inside autoscaler task!")
+					logging.exception(e)
+		except asyncio.CancelledError:
+			pass
+		logging.info("Autoscaler task done")
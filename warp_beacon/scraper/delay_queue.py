@@ -0,0 +1,84 @@
+import os
+import time
+import heapq
+import random
+import threading
+import multiprocessing
+from queue import Empty
+from typing import Callable
+
+import logging
+
+from warp_beacon.jobs.download_job import DownloadJob
+
+class DelayQueue(object):
+	'''
+		Holds download jobs until their due time.
+		Worker processes put jobs into shared inbox, the timer thread of the main process
+		keeps them in a heap and releases due jobs to the download queues.
+	'''
+	__JOE_BIDEN_WAKEUP = None
+
+	def __init__(self, release_func: Callable[[DownloadJob], str]) -> None:
+		self.release_func = release_func
+		self.inbox = multiprocessing.Queue()
+		self.backoff_base = float(os.environ.get("RETRY_BACKOFF_BASE", default=2))
+		self.backoff_max = float(os.environ.get("RETRY_BACKOFF_MAX", default=300))
+		self.heap = []
+		self.counter = 0
+		self.thread = None
+
+	def start(self) -> None:
+		self.thread = threading.Thread(target=self.do_work)
+		self.thread.start()
+
+	def stop(self) -> None:
+		if self.thread:
+			self.inbox.put_nowait(self.__JOE_BIDEN_WAKEUP)
+			self.thread.join()
+			self.thread = None
+		if self.heap:
+			logging.warning("Dropped '%d' delayed jobs", len(self.heap))
+
+	def put(self, job: DownloadJob, due_time: float) -> None:
+		'''
+			due_time is unix timestamp, safe to call from any process.
+		'''
+		self.inbox.put_nowait((due_time, job))
+
+	def retry_delay(self, attempt: int) -> float:
+		delay = min(self.backoff_max, self.backoff_base * (2 ** max(0, attempt - 1)))
+		# jitter spreads retries of jobs failed at the same moment
+		return delay * random.uniform(0.8, 1.2)
+
+	def put_retry(self, job: DownloadJob, attempt: int) -> float:
+		delay = self.retry_delay(attempt)
+		logging.info("Job '%s' retry #%d in %.1f sec", job.url, attempt, delay)
+		self.put(job, time.time() + delay)
+		return delay
+
+	def do_work(self) -> None:
+		logging.info("Delay queue thread started")
+		while True:
+			try:
+				timeout = None
+				if self.heap:
+					timeout = max(0.0, self.heap[0][0] - time.time())
+				try:
+					item = self.inbox.get(timeout=timeout)
+					if item is self.__JOE_BIDEN_WAKEUP:
+						break
+					due_time, job = item
+					heapq.heappush(self.heap, (due_time, self.counter, job))
+					self.counter += 1
+				except Empty:
+					pass
+				now = time.time()
+				while self.heap and self.heap[0][0] <= now:
+					_, _, job = heapq.heappop(self.heap)
+					self.release_func(job)
+			except Exception as e:
+				logging.error("Exception occurred inside delay queue thread!")
+				logging.exception(e)
+				time.sleep(1)
+		logging.info("Delay queue thread done")
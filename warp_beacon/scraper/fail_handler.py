@@ -1,61 +1,180 @@
+import os
+import time
 import pickle
+import uuid
+import random
 
 import logging
 
+from pymongo import ASCENDING, ReturnDocument
+
 from warp_beacon.storage.mongo import DBClient
+from warp_beacon.jobs.codec import JobCodec
 from warp_beacon.jobs.download_job import DownloadJob
 
 class FailHandler(object):
+	'''
+		Retry store of jobs failed on all service accounts.
+		Jobs are claimed in batches with lease, lease expires if worker died before finishing the job.
+	'''
+	PENDING = "pending"
+	LEASED = "leased"
+	KEY_INDEX_NAME = "failed_job_key"
+	DUE_INDEX_NAME = "failed_job_due"
 	client = None
 	db = None
 	def __init__(self, client: DBClient) -> None:
 		self.client = client
 		self.db = self.client.client.media.failed_jobs
+		self.backoff_base = float(os.environ.get("FAILED_JOB_BACKOFF_BASE", default=60))
+		self.backoff_max = float(os.environ.get("FAILED_JOB_BACKOFF_MAX", default=3600))
+		self.max_attempts = int(os.environ.get("FAILED_JOB_MAX_ATTEMPTS", default=5))
+		self.lease_time = float(os.environ.get("FAILED_JOB_LEASE_TIME", default=900))
+		self.claim_interval = float(os.environ.get("FAILED_JOB_CLAIM_INTERVAL", default=30))
+		self.claim_batch = int(os.environ.get("FAILED_JOB_CLAIM_BATCH", default=10))
+		self.last_claim = 0.0
 
 	def __del__(self) -> None:
 		self.client.close()
 
+	def ensure_indexes(self) -> None:
+		'''
+			Migration, must be called once from the main process before workers start.
+			Due index doesn't depend on the unique key index, which needs duplicates of former versions removed.
+		'''
+		try:
+			indexes = self.db.index_information()
+			if self.DUE_INDEX_NAME not in indexes:
+				# documents stored by former versions have no retry state
+				self.db.update_many(
+					{"status": {"$exists": False}},
+					{"$set": {"status": self.PENDING, "next_attempt_at": 0.0, "attempts": 0}}
+				)
+				self.db.create_index([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name=self.DUE_INDEX_NAME)
+		except Exception as e:
+			logging.error("Failed to create failed jobs due index!")
+			logging.exception(e)
+		try:
+			if self.KEY_INDEX_NAME in self.db.index_information():
+				return
+			# the oldest record of every job is kept
+			duplicates = self.db.aggregate([
+				{"$sort": {"_id": 1}},
+				{"$group": {"_id": {"uniq_id": "$uniq_id", "message_id": "$message_id", "chat_id": "$chat_id"}, "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+				{"$match": {"count": {"$gt": 1}}}
+			], allowDiskUse=True)
+			removed = 0
+			for dup in duplicates:
+				removed += self.db.delete_many({"_id": {"$in": dup["ids"][1:]}}).deleted_count
+			logging.info("Removed '%d' duplicate failed jobs", removed)
+			self.db.create_index(
+				[("uniq_id", ASCENDING), ("message_id", ASCENDING), ("chat_id", ASCENDING)],
+				name=self.KEY_INDEX_NAME,
+				unique=True
+			)
+		except Exception as e:
+			logging.error("Failed to create failed jobs key index!")
+			logging.exception(e)
+
+	@staticmethod
+	def job_key(job: DownloadJob) -> dict:
+		return {"uniq_id": job.uniq_id, "message_id": job.message_id, "chat_id": job.chat_id}
+
 	def store_failed_job(self, job: DownloadJob) -> int:
 		db_id = ""
 		try:
-			# check if job not already in storage
-			find_opts = {"uniq_id": job.uniq_id, "message_id": job.message_id, "chat_id": job.chat_id}
-			if self.db.find_one(find_opts) is not None:
-				logging.info("Job already in storage skipping write")
-				return 0
-			#
-			job_serilized = pickle.dumps(job)
-			db_id = self.db.insert_one(
-			{
-				"job_data": job_serilized,
-				"uniq_id": job.uniq_id,
-				"message_id": job.message_id,
-				"chat_id": job.chat_id
-			}).inserted_id
+			# attempts are counted on claim, retry time is computed from them in the same write,
+			# so stored job is never visible without it
+			attempts = {"$ifNull": ["$attempts", 0]}
+			delay = {"$min": [self.backoff_max, {"$multiply": [self.backoff_base, {"$pow": [2, attempts]}]}]}
+			document = self.db.find_one_and_update(
+				self.job_key(job),
+				[{"$set": {
+					"job_data": {"$literal": JobCodec.encode(job)},
+					"status": self.PENDING,
+					"attempts": attempts,
+					"next_attempt_at": {"$add": [time.time(), {"$multiply": [delay, random.uniform(0.8, 1.2)]}]}
+				}}],
+				upsert=True,
+				return_document=ReturnDocument.AFTER
+			)
+			db_id = document["_id"]
 		except Exception as e:
 			logging.error("Failed to store job as failed!")
 			logging.exception(e)
 		return db_id
-	
-	def get_failed_jobs(self, clean: bool = True) -> list:
+
+	@staticmethod
+	def decode_job(job_data: bytes) -> DownloadJob:
+		try:
+			return JobCodec.decode(job_data)
+		except Exception:
+			# stored by former versions
+			return pickle.loads(job_data)
+
+	def claim_failed_jobs(self) -> list:
+		'''
+			Claims up to batch of due jobs, at most once per claim interval.
+			Claimed jobs stay leased until finished or lease expiration,
+			every claim counts as attempt.
+		'''
 		ret = []
+		now = time.time()
+		if now - self.last_claim < self.claim_interval:
+			return ret
+		self.last_claim = now
 		try:
-			cursor = self.db.find()
-			for document in cursor:
+			due = {"status": {"$in": [self.PENDING, self.LEASED]}, "next_attempt_at": {"$lte": now}}
+			ids = [i["_id"] for i in self.db.find(due, {"_id": 1}).sort("next_attempt_at", ASCENDING).limit(self.claim_batch)]
+			if not ids:
+				return ret
+			lease_id = uuid.uuid4().hex
+			# documents claimed by another worker in between don't match due filter anymore
+			self.db.update_many(
+				{"_id": {"$in": ids}, **due},
+				{
+					"$set": {"status": self.LEASED, "next_attempt_at": now + self.lease_time, "lease_id": lease_id},
+					"$inc": {"attempts": 1}
+				}
+			)
+			drop_ids = []
+			for document in self.db.find({"_id": {"$in": ids}, "lease_id": lease_id}):
+				if document.get("attempts", 0) > self.max_attempts:
+					logging.warning("Failed job '%s' exceeded '%d' attempts, giving up", document.get("uniq_id"), self.max_attempts)
+					drop_ids.append(document["_id"])
+					continue
+				try:
+					job = self.decode_job(document["job_data"])
+				except Exception as e:
+					logging.error("Failed to decode failed job, dropping!")
+					logging.exception(e)
+					drop_ids.append(document["_id"])
+					continue
+				job.failed_job_replay = True
 				ret.append({
 					"_id": document["_id"],
-					"job": pickle.loads(document["job_data"]),
+					"job": job,
 					"uniq_id": document.get("uniq_id"),
 					"message_id": document.get("message_id"),
 					"chat_id": document.get("chat_id")
 				})
-			if clean:
-				self.db.delete_many({})
+			if drop_ids:
+				self.db.delete_many({"_id": {"$in": drop_ids}})
 		except Exception as e:
 			logging.error("Failed to get failed jobs!")
 			logging.exception(e)
 		return ret
-	
+
+	def finish_job(self, job: DownloadJob) -> bool:
+		try:
+			result = self.db.delete_one(self.job_key(job))
+			if result.deleted_count > 0:
+				return True
+		except Exception as e:
+			logging.error("Failed to finish failed job!", exc_info=e)
+
+		return False
+
 	def remove_failed_job(self, uniq_id: str) -> bool:
 		try:
 			result = self.db.delete_one({"uniq_id": uniq_id})
@@ -64,4 +183,4 @@ class FailHandler(object):
 		except Exception as e:
 			logging.error("Failed to remove failed job!", exc_info=e)
 
-		return False
\ No newline at end of file
+		return False
@@ -0,0 +1,77 @@
+import os
+import multiprocessing
+from enum import Enum
+from urllib.parse import urlparse
+
+import logging
+
+from warp_beacon.jobs import Origin
+from warp_beacon.jobs.download_job import DownloadJob
+
+class JobLane(Enum):
+	LIGHT = "light"
+	HEAVY = "heavy"
+
+class LaneClassifier(object):
+	'''
+		Predicts download job cost by origin, URL kind and historical timings.
+		Timings are shared between worker processes through shared memory slots of fixed keys table,
+		so classification is never an IPC round trip.
+	'''
+	# origins with mostly small media or plain text
+	LIGHT_ORIGINS = (Origin.INSTAGRAM, Origin.YT_SHORTS, Origin.YT_MUSIC)
+	# URL path markers that mean long video even for light origins
+	HEAVY_HINTS = ("/tv/", "/live/", "/playlist")
+	# URL kinds of instagram jobs with own timings, the rest are counted as 'other'
+	INSTAGRAM_KINDS = ("reel", "reels", "p", "stories", "tv", "share", "other")
+	KEYS = tuple(
+		[origin.value for origin in Origin] + [f"{Origin.INSTAGRAM.value}:{kind}" for kind in INSTAGRAM_KINDS]
+	)
+	EWMA_ALPHA = 0.2
+
+	def __init__(self) -> None:
+		# average seconds and samples count per key
+		self.timings = multiprocessing.RawArray('d', len(self.KEYS) * 2)
+		self.slots = {key: i * 2 for i, key in enumerate(self.KEYS)}
+		self.lock = multiprocessing.Lock()
+		self.light_max_seconds = float(os.environ.get("LIGHT_JOB_MAX_SECONDS", default=20))
+		self.min_samples = int(os.environ.get("LIGHT_JOB_MIN_SAMPLES", default=5))
+
+	@staticmethod
+	def timing_key(job: DownloadJob) -> str:
+		if job.job_origin is Origin.INSTAGRAM:
+			path = urlparse(job.url).path.strip('/').split('/')
+			# /reel/<id>, /p/<id>, /stories/<user>/<id>
+			kind = path[0] if path and path[0] in LaneClassifier.INSTAGRAM_KINDS else "other"
+			return f"{job.job_origin.value}:{kind}"
+		return job.job_origin.value
+
+	def classify(self, job: DownloadJob) -> JobLane:
+		if job.session_validation:
+			return JobLane.LIGHT
+		if job.scroll_content:
+			# background human simulation must not take reserved capacity
+			return JobLane.HEAVY
+		url = job.url.lower()
+		if any(hint in url for hint in self.HEAVY_HINTS):
+			return JobLane.HEAVY
+		slot = self.slots.get(self.timing_key(job), None)
+		# lockless read, average may be one sample behind
+		if slot is not None and self.timings[slot + 1] >= self.min_samples:
+			return JobLane.LIGHT if self.timings[slot] <= self.light_max_seconds else JobLane.HEAVY
+		if job.job_origin in self.LIGHT_ORIGINS:
+			return JobLane.LIGHT
+		return JobLane.HEAVY
+
+	def record(self, job: DownloadJob, seconds: float) -> None:
+		key = self.timing_key(job)
+		slot = self.slots.get(key, None)
+		if slot is None:
+			logging.warning("No timings slot for key '%s'", key)
+			return
+		with self.lock:
+			if self.timings[slot + 1] == 0:
+				self.timings[slot] = seconds
+			else:
+				self.timings[slot] += self.EWMA_ALPHA * (seconds - self.timings[slot])
+			self.timings[slot + 1] += 1
@@ -0,0 +1,164 @@
+import os
+import queue
+import multiprocessing
+from typing import Optional
+
+import logging
+
+from warp_beacon.jobs import Origin
+from warp_beacon.jobs.codec import JobCodec
+from warp_beacon.jobs.download_job import DownloadJob
+
+class OriginLimits(object):
+	'''
+		Concurrency limits of download jobs per origin, shared by all worker processes.
+		Format: ORIGIN_CONCURRENCY="X:2,instagram:8,youtube:4", origins without limit are not restricted.
+		Jobs over the limit wait in per origin FIFO and are handed over with the slot when it's released.
+		Slot owners are recorded, so slots of killed workers are reclaimed.
+	'''
+	ORIGINS = tuple(Origin)
+	# in_use, peak, throttled, waiting
+	COUNTERS = 4
+
+	def __init__(self, capacity: int) -> None:
+		self.limits = self.parse_limits(os.environ.get("ORIGIN_CONCURRENCY", default="X:2"))
+		self.counters = multiprocessing.RawArray('i', len(self.ORIGINS) * self.COUNTERS)
+		# every worker holds at most one slot: (owner pid, origin index + 1)
+		self.capacity = capacity
+		self.owners = multiprocessing.RawArray('i', capacity * 2)
+		self.waiting = {origin: multiprocessing.Queue() for origin in self.limits}
+		self.lock = multiprocessing.Lock()
+
+	@staticmethod
+	def parse_limits(raw: str) -> dict:
+		origins = {origin.value.lower(): origin for origin in Origin}
+		limits = {}
+		for item in raw.split(','):
+			if ':' not in item:
+				continue
+			name, limit = item.rsplit(':', 1)
+			origin = origins.get(name.strip().lower(), None)
+			if origin is None:
+				logging.warning("Unknown origin '%s' in concurrency limits", name)
+				continue
+			try:
+				limits[origin] = max(1, int(limit))
+			except ValueError:
+				logging.warning("Bad concurrency limit '%s'", item)
+		return limits
+
+	def offset(self, origin: Origin) -> int:
+		return self.ORIGINS.index(origin) * self.COUNTERS
+
+	def set_owner(self, pid: int, origin: Optional[Origin]) -> None:
+		'''
+			Must be called under lock. None origin clears the owner record.
+		'''
+		if origin is None:
+			for i in range(0, self.capacity * 2, 2):
+				if self.owners[i] == pid:
+					self.owners[i] = 0
+					self.owners[i + 1] = 0
+					return
+			return
+		for i in range(0, self.capacity * 2, 2):
+			if self.owners[i] == 0:
+				self.owners[i] = pid
+				self.owners[i + 1] = self.ORIGINS.index(origin) + 1
+				return
+		logging.warning("Origin slots owners table is full, slot of worker #%d can't be reclaimed", pid)
+
+	def acquire(self, job: DownloadJob) -> bool:
+		'''
+			Non blocking. Returns False if limit is reached, then job is parked in origin FIFO
+			and will be handed over to the worker which releases the slot.
+		'''
+		origin = job.job_origin
+		limit = self.limits.get(origin, 0)
+		offset = self.offset(origin)
+		with self.lock:
+			if limit and self.counters[offset] >= limit:
+				self.counters[offset + 2] += 1
+				self.counters[offset + 3] += 1
+				self.waiting[origin].put(JobCodec.encode(job))
+				return False
+			self.counters[offset] += 1
+			self.counters[offset + 1] = max(self.counters[offset + 1], self.counters[offset])
+			self.set_owner(os.getpid(), origin)
+			return True
+
+	def pop_waiting(self, origin: Origin) -> Optional[DownloadJob]:
+		'''
+			Must be called under lock.
+		'''
+		offset = self.offset(origin)
+		if not self.counters[offset + 3]:
+			return None
+		self.counters[offset + 3] -= 1
+		try:
+			# item is counted before put, feeder thread of producer may be a bit late
+			return JobCodec.decode(self.waiting[origin].get(timeout=5))
+		except queue.Empty:
+			logging.error("Waiting job of origin '%s' is lost!", origin.value)
+		return None
+
+	def release(self, origin: Origin, handoff: bool = True) -> Optional[DownloadJob]:
+		'''
+			Returns the oldest waiting job of origin, the slot stays with the caller for this job.
+			Without handoff the slot is just freed.
+		'''
+		with self.lock:
+			job = self.pop_waiting(origin) if handoff else None
+			if job is not None:
+				return job
+			offset = self.offset(origin)
+			self.counters[offset] = max(0, self.counters[offset] - 1)
+			self.set_owner(os.getpid(), None)
+		return None
+
+	def reclaim(self, pid: int) -> list[DownloadJob]:
+		'''
+			Frees slots of dead worker, returns waiting jobs which have to be queued again.
+		'''
+		jobs = []
+		with self.lock:
+			for i in range(0, self.capacity * 2, 2):
+				if self.owners[i] != pid:
+					continue
+				origin = self.ORIGINS[self.owners[i + 1] - 1]
+				self.owners[i] = 0
+				self.owners[i + 1] = 0
+				offset = self.offset(origin)
+				self.counters[offset] = max(0, self.counters[offset] - 1)
+				logging.warning("Reclaimed '%s' slot of dead worker #%d", origin.value, pid)
+				job = self.pop_waiting(origin)
+				if job is not None:
+					jobs.append(job)
+		return jobs
+
+	def drain(self) -> list[DownloadJob]:
+		'''
+			Returns all waiting jobs, called on shutdown when no worker takes them anymore.
+		'''
+		jobs = []
+		with self.lock:
+			for origin in self.waiting:
+				while self.counters[self.offset(origin) + 3]:
+					job = self.pop_waiting(origin)
+					if job is not None:
+						jobs.append(job)
+		return jobs
+
+	def stats(self) -> dict:
+		ret = {}
+		with self.lock:
+			for origin in self.ORIGINS:
+				offset = self.offset(origin)
+				ret[origin.value] = {
+					"limit": self.limits.get(origin, 0),
+					"in_use": self.counters[offset],
+					"peak": self.counters[offset + 1],
+					"throttled": self.counters[offset + 2],
+					"waiting": self.counters[offset + 3]
+				}
+		return ret
@@ -1,10 +1,19 @@
 import os
+import time
+import datetime
+import threading
 #from typing import Optional
 from enum import Enum
 
 from urllib.parse import urlparse, parse_qs
 
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from bson.objectid import ObjectId
+
 from warp_beacon.storage.mongo import DBClient
+from warp_beacon.storage.cache import LRUCache
+from warp_beacon.storage.bloom import BloomFilter
 
 import logging
 
@@ -17,17 +26,137 @@ class UrlParseMode(Enum):
 VIDEO_STORAGE_DIR = os.environ.get("VIDEO_STORAGE_DIR", default="/var/warp_beacon/videos")
 
 class Storage(object):
+	UNIQ_INDEX_NAME = "uniq_id_origin"
+	# lookups are index backed document fetches, projection only trims returned fields
+	RECORD_PROJECTION = {
+		"_id": 0,
+		"uniq_id": 1,
+		"tg_file_id": 1,
+		"media_type": 1,
+		"canonical_name": 1,
+		"message_text": 1,
+		"origin": 1
+	}
 	client = None
 	db = None
+	cache = None
+	known_ids = None
+	known_ids_ready = None
 	def __init__(self, client: DBClient) -> None:
 		if not os.path.isdir(VIDEO_STORAGE_DIR):
 			os.mkdir(VIDEO_STORAGE_DIR)
 		self.client = client
 		self.db = self.client.client.media.media
+		self.cache = LRUCache(
+			max_size=int(os.environ.get("STORAGE_CACHE_SIZE", default=10000)),
+			ttl=int(os.environ.get("STORAGE_CACHE_TTL", default=3600))
+		)
+		self.known_ids_path = os.environ.get("STORAGE_BLOOM_PATH", default="/var/warp_beacon/known_ids.bloom")
+		self.known_ids_capacity = int(os.environ.get("STORAGE_BLOOM_CAPACITY", default=5000000))
+		self.known_ids_error_rate = float(os.environ.get("STORAGE_BLOOM_ERROR_RATE", default=0.001))
+		self.known_ids = BloomFilter(capacity=self.known_ids_capacity, error_rate=self.known_ids_error_rate)
+		self.known_ids_ready = threading.Event()
+		self.bloom_skips = 0
+		threading.Thread(target=self.prepare, daemon=True).start()
 
 	def __del__(self) -> None:
 		self.client.close()
 
+	def prepare(self) -> None:
+		'''
+			Background startup: index migration may scan the whole collection, filter is built after it.
+		'''
+		self.ensure_indexes()
+		self.load_known_ids()
+
+	def ensure_indexes(self) -> None:
+		'''
+			Migration: unique (uniq_id, origin) index.
+			Duplicates left by old read-then-write inserts block index creation,
+			they are removed only if STORAGE_DEDUPE_MIGRATION="true", otherwise just counted.
+		'''
+		try:
+			if self.UNIQ_INDEX_NAME in self.db.index_information():
+				return
+			dedupe = os.environ.get("STORAGE_DEDUPE_MIGRATION", default="false") == "true"
+			logging.info("Creating unique index '%s', this may take a while ...", self.UNIQ_INDEX_NAME)
+			# the oldest record of every group is kept
+			duplicates = self.db.aggregate([
+				{"$sort": {"_id": 1}},
+				{"$group": {"_id": {"uniq_id": "$uniq_id", "origin": "$origin"}, "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+				{"$match": {"count": {"$gt": 1}}}
+			], allowDiskUse=True)
+			found, removed = 0, 0
+			for dup in duplicates:
+				found += dup["count"] - 1
+				if dedupe:
+					removed += self.db.delete_many({"_id": {"$in": dup["ids"][1:]}}).deleted_count
+			if found and not dedupe:
+				logging.warning(
+					"Found '%d' duplicate media records, unique index '%s' is not created. Set STORAGE_DEDUPE_MIGRATION=\"true\" to remove them",
+					found, self.UNIQ_INDEX_NAME
+				)
+				return
+			logging.info("Removed '%d' duplicate media records", removed)
+			self.db.create_index(
+				[("uniq_id", ASCENDING), ("origin", ASCENDING)],
+				unique=True,
+				name=self.UNIQ_INDEX_NAME
+			)
+			logging.info("Index '%s' created", self.UNIQ_INDEX_NAME)
+		except Exception as e:
+			logging.error("Failed to create storage indexes!")
+			logging.exception(e)
+
+	def load_known_ids(self) -> None:
+		'''
+			Fills uniq_ids Bloom filter from disk snapshot and streams records stored after it.
+			Without snapshot the whole collection is streamed in unique index order with uniq_id projection.
+		'''
+		try:
+			start_time = time.time()
+			query, hint = {}, self.UNIQ_INDEX_NAME
+			if self.known_ids_path:
+				bloom = BloomFilter.load(self.known_ids_path, self.known_ids_capacity, self.known_ids_error_rate)
+				if bloom:
+					self.known_ids = bloom
+					# ObjectId keeps creation time, catch up with records written after snapshot
+					since = datetime.datetime.fromtimestamp(bloom.saved_at - 60, tz=datetime.timezone.utc)
+					query, hint = {"_id": {"$gt": ObjectId.from_datetime(since)}}, None
+					logging.info("Loaded '%d' known uniq_ids from '%s'", bloom.count, self.known_ids_path)
+			cursor = self.db.find(query, {"_id": 0, "uniq_id": 1}).batch_size(10000)
+			if hint and self.UNIQ_INDEX_NAME in self.db.index_information():
+				cursor = cursor.hint(hint)
+			loaded = 0
+			for document in cursor:
+				if document.get("uniq_id"):
+					self.known_ids.add(document["uniq_id"])
+					loaded += 1
+			self.known_ids_ready.set()
+			logging.info("Known uniq_ids filter is ready, '%d' ids streamed in '%.2f' sec", loaded, time.time() - start_time)
+		except Exception as e:
+			logging.error("Failed to build known uniq_ids filter, all lookups go to the database!")
+			logging.exception(e)
+
+	def save_known_ids(self) -> None:
+		if not self.known_ids_path or not self.known_ids_ready.is_set():
+			return
+		try:
+			self.known_ids.save(self.known_ids_path, saved_at=time.time())
+			logging.info("Known uniq_ids filter saved to '%s'", self.known_ids_path)
+		except Exception as e:
+			logging.warning("Failed to save known uniq_ids filter!")
+			logging.exception(e)
+
+	def is_known(self, uniq_id: str) -> bool:
+		'''
+			False means uniq_id is definitely not stored.
+		'''
+		if not self.known_ids_ready.is_set() or uniq_id in self.known_ids:
+			return True
+		self.bloom_skips += 1
+		return False
+
 	@staticmethod
 	def compute_uniq(url: str) -> str:
 		parse_mode = UrlParseMode.OTHER
@@ -52,24 +181,61 @@ class Storage(object):
 		path = urlparse(url).path.strip('/')
 		return path
 	
+	@staticmethod
+	def doc_to_record(document: dict) -> dict:
+		return {
+			"uniq_id": document["uniq_id"],
+			"tg_file_id": document["tg_file_id"],
+			"media_type": document["media_type"],
+			"canonical_name": document.get("canonical_name"),
+			"message_text": document.get("message_text"),
+			"origin": document.get("origin")
+		}
+
+	def cache_stats(self) -> dict:
+		stats = self.cache.stats()
+		stats["bloom_skips"] = self.bloom_skips
+		return stats
+
 	def db_find(self, uniq_id: str, origin: str = "") -> list[dict]:
-		document = None
 		ret = []
+		cached = self.cache.get(uniq_id)
+		if cached is not None:
+			return [i for i in cached if not origin or i["origin"] == origin]
+		if not self.is_known(uniq_id):
+			return ret
 		try:
 			logging.debug("uniq_id to search is '%s'", uniq_id)
-			find_opts = {"uniq_id": uniq_id}
+			cursor = self.db.find({"uniq_id": uniq_id}, self.RECORD_PROJECTION)
+			for document in cursor:
+				ret.append(self.doc_to_record(document))
+			if ret:
+				self.cache.put(uniq_id, list(ret))
 			if origin:
-				find_opts["origin"] = origin
-			cursor = self.db.find(find_opts)
+				ret = [i for i in ret if i["origin"] == origin]
+		except Exception as e:
+			logging.error("Error occurred while trying to read from the database!")
+			logging.exception(e)
+		return ret
+
+	def db_find_many(self, uniq_ids: list[str]) -> dict[str, list[dict]]:
+		ret, missing = {}, []
+		for uniq_id in uniq_ids:
+			cached = self.cache.get(uniq_id)
+			if cached is not None:
+				ret[uniq_id] = list(cached)
+			elif self.is_known(uniq_id):
+				missing.append(uniq_id)
+		if not missing:
+			return ret
+		try:
+			logging.debug("uniq_ids to search are '%s'", missing)
+			cursor = self.db.find({"uniq_id": {"$in": missing}}, self.RECORD_PROJECTION)
 			for document in cursor:
-				ret.append(
-				{
-					"uniq_id": document["uniq_id"],
-					"tg_file_id": document["tg_file_id"],
-					"media_type": document["media_type"],
-					"canonical_name": document.get("canonical_name"),
-					"message_text": document.get("message_text")
-				})
+				ret.setdefault(document["uniq_id"], []).append(self.doc_to_record(document))
+			for uniq_id in missing:
+				if uniq_id in ret:
+					self.cache.put(uniq_id, list(ret[uniq_id]))
 		except Exception as e:
 			logging.error("Error occurred while trying to read from the database!")
 			logging.exception(e)
@@ -83,22 +249,43 @@ class Storage(object):
 	def db_lookup_id(self, uniq_id: str) -> list[dict]:
 		return self.db_find(uniq_id)
 	
-	def add_media(self, tg_file_ids: list[str], media_url: str, media_type: str, origin: str, canonical_name: str = "", message_text: str = "") -> list[int]:
+	def add_media(self, tg_file_ids: list[str], media_url: str, media_type: str, origin: str, canonical_name: str = "", message_text: str = "") -> list[str]:
 		uniq_id = self.compute_uniq(media_url)
 		media_ids = []
+		documents, ops = [], []
 		for tg_file_id in tg_file_ids:
-			if self.db_lookup_id(uniq_id):
-				logging.info("Detected existing uniq_id, skipping storage write operation")
-				continue
-			media_ids += str(self.db.insert_one(
-			{
+			document = {
 				"uniq_id": uniq_id,
 				"media_type": media_type,
 				"tg_file_id": tg_file_id,
 				"origin": origin,
 				"canonical_name": canonical_name,
 				"message_text": message_text
-			}).inserted_id)
+			}
+			documents.append(document)
+			# idempotent write, existing record is never overwritten
+			ops.append(UpdateOne({"uniq_id": uniq_id, "origin": origin}, {"$setOnInsert": document}, upsert=True))
+		if not ops:
+			return media_ids
+
+		records = []
+		try:
+			result = self.db.bulk_write(ops, ordered=True)
+			for index, media_id in result.upserted_ids.items():
+				media_ids.append(str(media_id))
+				records.append(self.doc_to_record(documents[index]))
+			if not media_ids:
+				logging.info("Detected existing uniq_id, skipping storage write operation")
+		except BulkWriteError as e:
+			# concurrent upsert of the same key, record is already stored
+			if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+				raise
+			logging.info("Detected existing uniq_id, skipping storage write operation")
+
+		self.known_ids.add(uniq_id)
+		self.cache.invalidate(uniq_id)
+		if records:
+			self.cache.put(uniq_id, records)
 
 		return media_ids
 	
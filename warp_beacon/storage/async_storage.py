@@ -0,0 +1,56 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from warp_beacon.storage import Storage
+
+class AsyncStorage(object):
+	'''
+		Storage API for coroutines.
+		Blocking pymongo calls are performed in a dedicated thread pool,
+		so slow queries don't stall the Telegram event loop.
+	'''
+	storage = None
+	executor = None
+
+	def __init__(self, storage: Storage, pool_size: int = 4) -> None:
+		self.storage = storage
+		self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="storage")
+
+	def shutdown(self) -> None:
+		self.executor.shutdown(wait=True, cancel_futures=True)
+
+	async def run(self, func: Callable, *args, **kwargs) -> object:
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+	@staticmethod
+	def compute_uniq(url: str) -> str:
+		return Storage.compute_uniq(url)
+
+	async def db_find(self, uniq_id: str, origin: str = "") -> list[dict]:
+		return await self.run(self.storage.db_find, uniq_id, origin)
+
+	async def db_find_many(self, uniq_ids: list[str]) -> dict[str, list[dict]]:
+		return await self.run(self.storage.db_find_many, uniq_ids)
+
+	async def db_lookup(self, url: str) -> dict:
+		return await self.run(self.storage.db_lookup, url)
+
+	async def db_lookup_id(self, uniq_id: str) -> list[dict]:
+		return await self.run(self.storage.db_lookup_id, uniq_id)
+
+	async def add_media(self, tg_file_ids: list[str], media_url: str, media_type: str, origin: str, canonical_name: str = "", message_text: str = "") -> list[str]:
+		return await self.run(
+			self.storage.add_media,
+			tg_file_ids=tg_file_ids,
+			media_url=media_url,
+			media_type=media_type,
+			origin=origin,
+			canonical_name=canonical_name,
+			message_text=message_text
+		)
+
+	async def get_random(self) -> dict:
+		return await self.run(self.storage.get_random)
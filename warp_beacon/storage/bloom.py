@@ -0,0 +1,73 @@
+import os
+import math
+import struct
+import hashlib
+import threading
+
+import logging
+
+class BloomFilter(object):
+	'''
+		Set membership with no false negatives.
+		Positions are computed with double hashing over a single blake2b digest.
+	'''
+	HEADER = struct.Struct("<QQQd")
+
+	def __init__(self, capacity: int = 5000000, error_rate: float = 0.001) -> None:
+		self.capacity = max(1, capacity)
+		self.error_rate = error_rate
+		self.size = max(8, int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))))
+		self.hashes = max(1, int(round(self.size / self.capacity * math.log(2))))
+		self.bits = bytearray((self.size + 7) // 8)
+		self.count = 0
+		self.saved_at = 0.0
+		self.lock = threading.Lock()
+
+	def positions(self, key: str) -> list[int]:
+		digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+		h1 = int.from_bytes(digest[:8], "little")
+		h2 = int.from_bytes(digest[8:], "little") | 1
+		return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+	def add(self, key: str) -> None:
+		positions = self.positions(key)
+		with self.lock:
+			for pos in positions:
+				self.bits[pos >> 3] |= 1 << (pos & 7)
+			self.count += 1
+			if self.count == self.capacity:
+				logging.warning("Bloom filter capacity '%d' reached, false positive rate will grow", self.capacity)
+
+	def __contains__(self, key: str) -> bool:
+		bits = self.bits
+		return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self.positions(key))
+
+	def save(self, path: str, saved_at: float) -> None:
+		tmp_path = f"{path}.tmp"
+		with self.lock:
+			with open(tmp_path, "wb") as f:
+				f.write(self.HEADER.pack(self.size, self.hashes, self.count, saved_at))
+				f.write(self.bits)
+		os.replace(tmp_path, path)
+
+	@classmethod
+	def load(cls, path: str, capacity: int, error_rate: float) -> "BloomFilter":
+		'''
+			Returns None if file is absent or was built with other parameters.
+		'''
+		if not os.path.exists(path):
+			return None
+		bloom = cls(capacity=capacity, error_rate=error_rate)
+		with open(path, "rb") as f:
+			size, hashes, count, saved_at = cls.HEADER.unpack(f.read(cls.HEADER.size))
+			if size != bloom.size or hashes != bloom.hashes:
+				logging.info("Bloom filter parameters changed, snapshot '%s' ignored", path)
+				return None
+			bits = f.read()
+		if len(bits) != len(bloom.bits):
+			logging.warning("Bloom filter snapshot '%s' is truncated", path)
+			return None
+		bloom.bits = bytearray(bits)
+		bloom.count = count
+		bloom.saved_at = saved_at
+		return bloom
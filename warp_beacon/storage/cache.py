@@ -0,0 +1,56 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+class LRUCache(object):
+	'''
+		Bounded thread safe LRU cache with per entry TTL.
+	'''
+	def __init__(self, max_size: int = 10000, ttl: int = 3600) -> None:
+		self.max_size = max_size
+		self.ttl = ttl
+		self.hits = 0
+		self.misses = 0
+		self.entries = OrderedDict()
+		self.lock = threading.Lock()
+
+	def get(self, key: str) -> Optional[object]:
+		with self.lock:
+			entry = self.entries.get(key, None)
+			if entry is not None:
+				expires, value = entry
+				if expires > time.monotonic():
+					self.entries.move_to_end(key)
+					self.hits += 1
+					return value
+				del self.entries[key]
+			self.misses += 1
+			return None
+
+	def put(self, key: str, value: object) -> None:
+		if self.max_size <= 0:
+			return
+		with self.lock:
+			self.entries[key] = (time.monotonic() + self.ttl, value)
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.max_size:
+				self.entries.popitem(last=False)
+
+	def invalidate(self, key: str) -> None:
+		with self.lock:
+			self.entries.pop(key, None)
+
+	def clear(self) -> None:
+		with self.lock:
+			self.entries.clear()
+
+	def stats(self) -> dict:
+		with self.lock:
+			total = self.hits + self.misses
+			return {
+				"size": len(self.entries),
+				"hits": self.hits,
+				"misses": self.misses,
+				"hit_ratio": (self.hits / total) if total else 0.0
+			}
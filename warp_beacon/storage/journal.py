@@ -0,0 +1,138 @@
+import os
+import time
+import sqlite3
+import asyncio
+import functools
+import threading
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+
+from warp_beacon.jobs.codec import JobCodec
+from warp_beacon.jobs.abstract import AbstractJob
+from warp_beacon.jobs.download_job import DownloadJob
+
+class JobJournal(object):
+	'''
+		Durable log of user requests in local SQLite database.
+		Request is journaled when its placeholder is created and marked done after delivery,
+		unfinished requests are replayed on startup.
+		Coroutines write through single writer thread, so commits and checkpoints don't stall the event loop
+		and keep their order.
+	'''
+	QUEUED = 0
+	DONE = 1
+
+	def __init__(self, path: str = "/var/warp_beacon/jobs_journal.db") -> None:
+		self.max_age = int(os.environ.get("JOB_JOURNAL_MAX_AGE", default=86400))
+		self.max_attempts = int(os.environ.get("JOB_JOURNAL_MAX_ATTEMPTS", default=3))
+		self.compact_every = int(os.environ.get("JOB_JOURNAL_COMPACT_EVERY", default=1000))
+		self.done_since_compact = 0
+		self.lock = threading.Lock()
+		self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+		self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+		self.db.execute("PRAGMA journal_mode=WAL")
+		# WAL with NORMAL survives process crash, only OS crash may lose last transactions
+		self.db.execute("PRAGMA synchronous=NORMAL")
+		self.db.execute(
+			"CREATE TABLE IF NOT EXISTS jobs ("
+			"key TEXT PRIMARY KEY, "
+			"state INTEGER NOT NULL, "
+			"payload BLOB NOT NULL, "
+			"attempts INTEGER NOT NULL DEFAULT 0, "
+			"created_at REAL NOT NULL, "
+			"updated_at REAL NOT NULL)"
+		)
+		self.db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at)")
+
+	@staticmethod
+	def key(job: AbstractJob) -> str:
+		# placeholder message is unique per user request and survives link resolution replays
+		return f"{job.chat_id}:{job.placeholder_message_id}"
+
+	def queued(self, job: DownloadJob) -> None:
+		now = time.time()
+		try:
+			with self.lock:
+				self.db.execute(
+					"INSERT INTO jobs (key, state, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+					"ON CONFLICT(key) DO UPDATE SET state=excluded.state, payload=excluded.payload, updated_at=excluded.updated_at",
+					(self.key(job), self.QUEUED, JobCodec.encode(job), now, now)
+				)
+		except Exception as e:
+			logging.error("Failed to journal job!")
+			logging.exception(e)
+
+	def done(self, job: AbstractJob) -> None:
+		try:
+			with self.lock:
+				cursor = self.db.execute(
+					"UPDATE jobs SET state = ?, updated_at = ? WHERE key = ? AND state = ?",
+					(self.DONE, time.time(), self.key(job), self.QUEUED)
+				)
+				self.done_since_compact += cursor.rowcount
+				if self.done_since_compact < self.compact_every:
+					return
+			self.compact()
+		except Exception as e:
+			logging.error("Failed to mark journaled job done!")
+			logging.exception(e)
+
+	def unfinished(self) -> list[DownloadJob]:
+		'''
+			Returns jobs to replay, every call counts as replay attempt.
+		'''
+		jobs = []
+		with self.lock:
+			rows = self.db.execute(
+				"SELECT key, payload, attempts FROM jobs WHERE state = ? AND created_at >= ? ORDER BY created_at",
+				(self.QUEUED, time.time() - self.max_age)
+			).fetchall()
+			for key, payload, attempts in rows:
+				if attempts >= self.max_attempts:
+					logging.warning("Journaled job '%s' exceeded replay attempts, dropping", key)
+					self.db.execute("UPDATE jobs SET state = ? WHERE key = ?", (self.DONE, key))
+					continue
+				try:
+					jobs.append(JobCodec.decode(payload))
+					self.db.execute("UPDATE jobs SET attempts = attempts + 1 WHERE key = ?", (key,))
+				except Exception as e:
+					logging.error("Failed to decode journaled job '%s'!", key)
+					logging.exception(e)
+					self.db.execute("UPDATE jobs SET state = ? WHERE key = ?", (self.DONE, key))
+		return jobs
+
+	def compact(self) -> None:
+		with self.lock:
+			cursor = self.db.execute(
+				"DELETE FROM jobs WHERE state = ? OR created_at < ?",
+				(self.DONE, time.time() - self.max_age)
+			)
+			self.done_since_compact = 0
+			self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+		logging.info("Job journal compacted, '%d' entries removed", cursor.rowcount)
+
+	async def run(self, func: Callable, *args, **kwargs) -> object:
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+	async def mark_queued(self, job: DownloadJob) -> None:
+		await self.run(self.queued, job)
+
+	async def mark_done(self, job: AbstractJob) -> None:
+		await self.run(self.done, job)
+
+	async def replay(self) -> list[DownloadJob]:
+		await self.run(self.compact)
+		return await self.run(self.unfinished)
+
+	def close(self) -> None:
+		try:
+			self.executor.shutdown(wait=True)
+			self.compact()
+			with self.lock:
+				self.db.close()
+		except Exception as e:
+			logging.error("Failed to close job journal!")
+			logging.exception(e)
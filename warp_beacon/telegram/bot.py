@@ -9,9 +9,9 @@ import uvloop
 
 from pyrogram import Client, filters
 from pyrogram.enums import ParseMode, ChatType
-from pyrogram.handlers import MessageHandler, CallbackQueryHandler
+from pyrogram.handlers import MessageHandler, CallbackQueryHandler, ChatMemberUpdatedHandler
 from pyrogram.types import InputMediaAudio, InputMediaPhoto, InputMediaVideo, InputMediaAnimation, InlineKeyboardButton, InlineKeyboardMarkup
-from pyrogram.errors import NetworkMigrate, BadRequest, MultiMediaTooLong, MessageIdInvalid, FloodWait
+from pyrogram.errors import NetworkMigrate, BadRequest, MultiMediaTooLong, MessageIdInvalid
 
 import warp_beacon
 from warp_beacon.__version__ import __version__
@@ -19,6 +19,8 @@ from warp_beacon.telegram.handlers import Handlers
 from warp_beacon.telegram.placeholder_message import PlaceholderMessage
 from warp_beacon.storage.mongo import DBClient
 from warp_beacon.storage import Storage
+from warp_beacon.storage.async_storage import AsyncStorage
+from warp_beacon.storage.journal import JobJournal
 from warp_beacon.uploader import AsyncUploader
 from warp_beacon.jobs.upload_job import UploadJob
 from warp_beacon.jobs.types import JobType
@@ -26,12 +28,17 @@ from warp_beacon.jobs import Origin
 from warp_beacon.telegram.utils import Utils
 from warp_beacon.telegram.caption_shortener import CaptionShortner
 from warp_beacon.scheduler.scheduler import IGScheduler
+from warp_beacon.scheduler.fair_queue import FairQueue
 from warp_beacon.telegram.edit_message import EditMessage
+from warp_beacon.telegram.upload_shards import UploadShards
+from warp_beacon.telegram.send_scheduler import SendScheduler
+from warp_beacon.telegram.progress_aggregator import ProgressAggregator
 from warp_beacon.telegram.download_status import DownloadStatus
 
 class Bot(object):
 	should_exit = None
 	storage = None
+	async_storage = None
 	uploader = None
 	downloader = None
 	allow_loop = True
@@ -39,8 +46,13 @@ class Bot(object):
 	handlers = None
 	placeholder = None
 	scheduler = None
+	fair_queue = None
+	journal = None
 	me = None
 	edit_message = None
+	upload_shards = None
+	send_scheduler = None
+	progress_aggregator = None
 	download_status = None
 
 	def __init__(self, tg_bot_name: str, tg_token: str, tg_api_id: str, tg_api_hash: str) -> None:
@@ -53,6 +65,11 @@ class Bot(object):
 		logging.getLogger("pyrogram").setLevel(logging.ERROR)
 		logging.info("Starting Warp Beacon version '%s' ...", __version__)
 		self.storage = Storage(DBClient())
+		self.async_storage = AsyncStorage(
+			storage=self.storage,
+			pool_size=int(os.environ.get("STORAGE_POOL_SIZE", default=4))
+		)
+		self.journal = JobJournal(os.environ.get("JOB_JOURNAL_PATH", default="/var/warp_beacon/jobs_journal.db"))
 		self.should_exit = asyncio.Event()
 		workers_amount = min(32, os.cpu_count() + 4)
 
@@ -68,7 +85,10 @@ class Bot(object):
 			ipv6=os.environ.get("TG_IPV6", default="false").lower() in ("1", "true", "yes")
 		)
 
-		self.editor = EditMessage(self.client)
+		self.send_scheduler = SendScheduler()
+		self.progress_aggregator = ProgressAggregator(self.client, self.send_scheduler)
+		self.editor = EditMessage(self.client, self.send_scheduler, self.progress_aggregator)
+		self.upload_shards = UploadShards(self.client, self.progress_aggregator, tg_bot_name, tg_api_id, tg_api_hash)
 		self.handlers = Handlers(self)
 
 		self.uploader = AsyncUploader(
@@ -79,19 +99,22 @@ class Bot(object):
 			pool_size=int(os.environ.get("UPLOAD_POOL_SIZE", default=workers_amount)),
 			loop=self.client.loop
 		)
-		self.download_status = DownloadStatus(self.client)
+		self.download_status = DownloadStatus(self.client, self.progress_aggregator)
 		self.downloader = warp_beacon.scraper.AsyncDownloader(
 			workers_count=int(os.environ.get("WORKERS_POOL_SIZE", default=workers_amount)),
 			uploader=self.uploader,
-			pipe_connection=self.download_status.child_conn
+			status_channel=self.download_status.channel
 		)
 
 		self.scheduler = IGScheduler(self.downloader)
+		self.fair_queue = FairQueue(self.downloader)
+		self.downloader.pending_jobs_func = self.fair_queue.size
 
 		self.client.add_handler(MessageHandler(self.handlers.start, filters.command("start")))
 		self.client.add_handler(MessageHandler(self.handlers.help, filters.command("help")))
 		self.client.add_handler(MessageHandler(self.handlers.random, filters.command("random")))
-		self.client.add_handler(MessageHandler(self.handlers.handler))
+		self.client.add_handler(MessageHandler(self.handlers.handler, filters.create(self.handlers.message_filter)))
+		self.client.add_handler(ChatMemberUpdatedHandler(self.handlers.chat_member_updated))
 		#TODO refactor to callback router
 		self.client.add_handler(CallbackQueryHandler(self.handlers.simple_button_handler, filters=filters.create(lambda _, __, q: not q.data.startswith("read_more:"))))
 		self.client.add_handler(CallbackQueryHandler(self.handlers.read_more_handler, filters=filters.create(lambda _, __, q: q.data.startswith("read_more:"))))
@@ -113,12 +136,18 @@ class Bot(object):
 			self.client.me = self.me
 			if self.me.is_premium:
 				os.environ["TG_PREMIUM"] = "true"
+			self.send_scheduler.start()
+			await self.upload_shards.start()
 			self.downloader.start()
+			self.fair_queue.start()
 			self.uploader.start()
-			loop.add_reader(self.download_status.status_pipe.fileno(), self.download_status.on_status)
+			self.download_status.start()
 			self.scheduler.start()
+			await self.handlers.replay_journal()
 			logging.info("Warp Beacon version '%s' started", __version__)
 			await self.should_exit.wait()
+			await self.upload_shards.stop()
+			await self.send_scheduler.stop()
 
 		self.stop()
 		logging.info("Warp Beacon version '%s' terminated.", __version__)
@@ -126,14 +155,22 @@ class Bot(object):
 	def stop(self) -> None:
 		logging.info("Warp Beacon is terminating. This may take a while ...")
 		self.scheduler.stop()
-		self.downloader.stop_all()
+		self.fair_queue.stop()
+		# channels are drained first, so download workers blocked on them can exit
 		self.uploader.stop_all()
+		self.download_status.stop()
+		self.downloader.stop_all()
+		self.async_storage.shutdown()
+		self.storage.save_known_ids()
+		self.journal.close()
 		if self.client and self.client.is_initialized and self.client.is_connected:
 			asyncio.run_coroutine_threadsafe(self.client.stop(), self.client.loop)
 
 	async def send_text(self, chat_id: int, text: str, reply_id: int = None) -> int:
 		try:
-			message_reply = await self.client.send_message(
+			message_reply = await self.send_scheduler.send(
+				chat_id,
+				self.client.send_message,
 				chat_id=chat_id,
 				text=text,
 				parse_mode=ParseMode.HTML,
@@ -187,7 +224,7 @@ class Bot(object):
 				msg_opts = {"chat_id": adm, "text": text, "parse_mode": ParseMode.HTML}
 				if reply_markup:
 					msg_opts["reply_markup"] = reply_markup
-				message_reply = await self.client.send_message(**msg_opts)
+				message_reply = await self.send_scheduler.send(adm, self.client.send_message, **msg_opts)
 				msg_ids.append(message_reply.id)
 			return msg_ids
 		except Exception as e:
@@ -424,6 +461,10 @@ class Bot(object):
 	async def upload_job(self, job: UploadJob) -> list[str]:
 		tg_file_ids = []
 		try:
+			if self.upload_shards.should_shard(job):
+				tg_file_id = await self.upload_shards.upload(job)
+				if tg_file_id:
+					job.tg_file_id = tg_file_id
 			retry_amount = 0
 			max_retries = int(os.environ.get("TG_MAX_RETRIES", default=5))
 			while not retry_amount >= max_retries:
@@ -453,13 +494,7 @@ class Bot(object):
 								JobType.TEXT: self.client.send_message
 							}
 							try:
-								while True:
-									try:
-										reply_message = await send_funcs[job.media_type](**self.build_tg_args(job))
-										break
-									except FloodWait as e:
-										logging.warning("FloodWait occurred, waiting '%d' seconds before retry", int(e.value))
-										await asyncio.sleep(e.value)
+								reply_message = await self.send_scheduler.send(job.chat_id, send_funcs[job.media_type], **self.build_tg_args(job))
 							except ValueError as e:
 								err_text = str(e)
 								if "Expected" in err_text:
@@ -468,7 +503,7 @@ class Bot(object):
 									expectation, reality = Utils.parse_expected_patronum_error(err_text)
 									job_args = self.build_tg_args(job)
 									job_args[reality.value.lower()] = job_args.pop(expectation.value.lower())
-									reply_message = await send_funcs[reality](**job_args)
+									reply_message = await self.send_scheduler.send(job.chat_id, send_funcs[reality], **job_args)
 
 						if reply_message:
 							tg_file_id = Utils.extract_file_id(reply_message)
@@ -481,14 +516,8 @@ class Bot(object):
 						snd_grp_options = {"chat_id": job.chat_id, "reply_to_message_id": job.message_id}
 						for i, media_chunk in enumerate(col_job_args["media"]):
 							snd_grp_options["media"] = media_chunk
-							messages = []
-							while True:
-								try:
-									messages = await self.client.send_media_group(**snd_grp_options)
-									break
-								except FloodWait as e:
-									logging.warning("FloodWait occurred, waiting '%d' seconds before retry", int(e.value))
-									await asyncio.sleep(e.value)
+							# every album item counts as separate message in Telegram limits
+							messages = await self.send_scheduler.send(job.chat_id, self.client.send_media_group, cost=len(media_chunk), **snd_grp_options)
 							sent_messages += messages
 							if job.media_collection:
 								for j, _ in enumerate(media_chunk):
@@ -0,0 +1,107 @@
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Optional
+
+from pyrogram import Client
+from pyrogram import enums
+from pyrogram.types import User
+
+import logging
+
+class ChatMembersIndex(object):
+	def __init__(self, is_admin: bool, ttl: int) -> None:
+		self.is_admin = is_admin
+		self.expires = time.monotonic() + ttl
+		self.usernames = {}
+		self.first_names = {}
+		self.members = {}
+
+	def is_expired(self) -> bool:
+		return time.monotonic() >= self.expires
+
+	def add(self, user: User) -> None:
+		self.remove(user.id)
+		username = user.username.lower() if user.username else ''
+		first_name = user.first_name.lower() if user.first_name else ''
+		if username:
+			self.usernames[username] = (user.id, user.first_name or user.last_name or user.username)
+		if first_name:
+			self.first_names.setdefault(first_name, (user.id, user.first_name))
+		self.members[user.id] = (username, first_name)
+
+	def remove(self, user_id: int) -> None:
+		username, first_name = self.members.pop(user_id, ('', ''))
+		if username and self.usernames.get(username, (None,))[0] == user_id:
+			del self.usernames[username]
+		if first_name and self.first_names.get(first_name, (None,))[0] == user_id:
+			del self.first_names[first_name]
+
+	def find(self, name: str) -> Optional[tuple[int, str]]:
+		name = name.lower()
+		return self.usernames.get(name, None) or self.first_names.get(name, None)
+
+class ChatMembersCache(object):
+	'''
+		Per chat index of members by lowercase username and first name.
+		Full member list is fetched once per TTL and kept fresh by member update events.
+		At most max_size least recently used chats are kept, expired ones are dropped together with their locks.
+	'''
+	def __init__(self, ttl: int = 3600, max_size: int = 1000) -> None:
+		self.ttl = ttl
+		self.max_size = max(1, max_size)
+		self.chats = OrderedDict()
+		self.locks = {}
+
+	async def get_index(self, client: Client, chat_id: int) -> ChatMembersIndex:
+		index = self.chats.get(chat_id, None)
+		if index and not index.is_expired():
+			self.chats.move_to_end(chat_id)
+			return index
+		lock = self.locks.setdefault(chat_id, asyncio.Lock())
+		async with lock:
+			# may be already refreshed by concurrent message
+			index = self.chats.get(chat_id, None)
+			if index and not index.is_expired():
+				return index
+			index = await self.build_index(client, chat_id)
+			self.chats[chat_id] = index
+			self.chats.move_to_end(chat_id)
+		self.evict()
+		return index
+
+	def evict(self) -> None:
+		for chat_id in [k for k, v in self.chats.items() if v.is_expired()]:
+			del self.chats[chat_id]
+		while len(self.chats) > self.max_size:
+			self.chats.popitem(last=False)
+		# lock in use is kept, concurrent refresh of the chat waits on it
+		for chat_id in [k for k, v in self.locks.items() if k not in self.chats and not v.locked()]:
+			del self.locks[chat_id]
+
+	async def build_index(self, client: Client, chat_id: int) -> ChatMembersIndex:
+		logging.info("Fetching members of chat_id: '%s'", str(chat_id))
+		chat_member = await client.get_chat_member(chat_id, client.me.id)
+		index = ChatMembersIndex(
+			is_admin=chat_member.status in (enums.ChatMemberStatus.ADMINISTRATOR, enums.ChatMemberStatus.OWNER),
+			ttl=self.ttl
+		)
+		if not index.is_admin:
+			return index
+		async for member in client.get_chat_members(chat_id):
+			if member.user:
+				index.add(member.user)
+		logging.info("Cached '%d' members of chat_id: '%s'", len(index.members), str(chat_id))
+		return index
+
+	def update_member(self, chat_id: int, user: User, is_member: bool) -> None:
+		index = self.chats.get(chat_id, None)
+		if not index:
+			return
+		if is_member:
+			index.add(user)
+		else:
+			index.remove(user.id)
+
+	def invalidate(self, chat_id: int) -> None:
+		self.chats.pop(chat_id, None)
@@ -1,25 +1,37 @@
+import pickle
 import logging
-from multiprocessing import Pipe
 from pyrogram import Client
 from warp_beacon.telegram.progress_bar import ProgressBar
 from warp_beacon.telegram.types import ReportType
+from warp_beacon.telegram.progress_aggregator import ProgressAggregator
+from warp_beacon.uploader.channel import ProcessChannel
 
 class DownloadStatus(object):
-	status_pipe = None
-	child_conn = None
+	'''
+		Receives download progress from all worker processes over one shared channel.
+	'''
+	channel = None
 	client = None
 	progress_bars = None
 
-	def __init__(self, client: Client) -> None:
+	def __init__(self, client: Client, progress_aggregator: ProgressAggregator) -> None:
 		self.progress_bars = {}
 		self.client = client
-		self.status_pipe, self.child_conn = Pipe()
+		self.progress_aggregator = progress_aggregator
+		self.channel = ProcessChannel()
 
-	async def handle_message(self, msg: dict, progress_bar: ProgressBar) -> None:
+	def start(self) -> None:
+		# progress messages are small, drain more of them per wakeup
+		self.channel.attach(self.client.loop, self.on_status, batch_size=256)
+
+	def stop(self) -> None:
+		self.channel.drain()
+
+	def handle_message(self, msg: dict, progress_bar: ProgressBar) -> None:
 		op = "Downloading"
 		if msg.get("media_type", None):
 			op += f" {msg['media_type']}"
-		await progress_bar.progress_callback(
+		progress_bar.progress(
 			current=msg.get("current", 0),
 			total=msg.get("total", 0),
 			message_id=msg.get("message_id", 0),
@@ -29,21 +41,21 @@ class DownloadStatus(object):
 			label=msg.get("label", "")
 		)
 
-	def on_status(self) -> None:
-		msg = self.status_pipe.recv()
+	def on_status(self, data: bytes) -> None:
+		msg = pickle.loads(data)
 		if not msg:
 			logging.warning("Empty status message!")
 			return
-		logging.info("Received pipe message: %s", msg)
+		logging.debug("Received pipe message: %s", msg)
 		message_id = msg.get("message_id", 0)
 		chat_id = msg.get("chat_id", 0)
 		a_key = f"{message_id}:{chat_id}"
-		progress_bar = None
-		if a_key not in self.progress_bars:
-			progress_bar = ProgressBar(self.client)
-			self.progress_bars[a_key] = progress_bar
-		else:
-			progress_bar = self.progress_bars[a_key]
-		task = self.client.loop.create_task(self.handle_message(msg, progress_bar))
 		if msg.get("completed", False):
-			task.add_done_callback(lambda _: self.progress_bars.pop(a_key, None))
\ No newline at end of file
+			self.progress_bars.pop(a_key, None)
+			self.progress_aggregator.complete(chat_id, message_id)
+			return
+		progress_bar = self.progress_bars.get(a_key, None)
+		if progress_bar is None:
+			progress_bar = ProgressBar(self.client, self.progress_aggregator)
+			self.progress_bars[a_key] = progress_bar
+		self.handle_message(msg, progress_bar)
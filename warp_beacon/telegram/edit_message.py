@@ -1,20 +1,22 @@
-import asyncio
 import re
 
-import logging
-
 from pyrogram.client import Client
 from pyrogram.types import InputMedia, InputMediaAudio, InputMediaPhoto, InputMediaVideo, InputMediaAnimation, InlineKeyboardMarkup
 from pyrogram import raw
 from pyrogram import types
-from pyrogram.errors import FloodWait
 
 from warp_beacon.telegram.progress_bar import ProgressBar
 from warp_beacon.telegram.types import ReportType
+from warp_beacon.telegram.upload_engine import UploadEngine
+from warp_beacon.telegram.send_scheduler import SendScheduler
+from warp_beacon.telegram.progress_aggregator import ProgressAggregator
 
 class EditMessage(object):
-	def __init__(self, client: Client) -> None:
+	def __init__(self, client: Client, send_scheduler: SendScheduler, progress_aggregator: ProgressAggregator) -> None:
 		self.client = client
+		self.send_scheduler = send_scheduler
+		self.progress_aggregator = progress_aggregator
+		self.upload_engine = UploadEngine(client)
 		self.base64_str_tpl = re.compile(r"[A-Za-z0-9\-_]{30,}")
 
 	def get_wrapped_video(self, raw_file: raw.base.InputFile, raw_thumb: raw.base.InputFile, media: InputMediaVideo, file_name: str = None) -> raw.types.InputMediaUploadedDocument:
@@ -92,9 +94,9 @@ class EditMessage(object):
 		is_looks_like_token = self.looks_like_token(media.media)
 		raw_file = None
 		if not is_looks_like_token:
-			progress_bar = ProgressBar(self.client)
+			progress_bar = ProgressBar(self.client, self.progress_aggregator)
 			#await progress_bar.progress_callback(current=0, total=0, chat_id=chat_id, message_id=message_id, operation="Uploading", label=file_name, report_type=ReportType.PROGRESS)
-			raw_file = await self.client.save_file(path=media.media, progress=progress_bar.progress_callback, progress_args=(chat_id, message_id, "Uploading", ReportType.PROGRESS, file_name))
+			raw_file = await self.upload_engine.save_file(path=media.media, progress=progress_bar.progress_callback, progress_args=(chat_id, message_id, "Uploading", ReportType.PROGRESS, file_name))
 		else:
 			raw_file = media.media
 
@@ -128,24 +130,21 @@ class EditMessage(object):
 				raw_file_thumb = await self.client.save_file(path=media.thumb)
 			raw_media = self.get_wrapped_animation(raw_file=raw_file, raw_thumb=raw_file_thumb, media=media, file_name=file_name)
 
-		peer, r = None, None
-		while True:
-			try:
-				peer = await self.client.resolve_peer(chat_id)
-				r = await self.client.invoke(
-					raw.functions.messages.EditMessage(
-						peer=peer,
-						id=message_id,
-						media=raw_media,
-						reply_markup=await reply_markup.write(self.client) if reply_markup else None,
-						message=message,
-						entities=entities
-					)
-				)
-				break
-			except FloodWait as e:
-				logging.warning("FloodWait occurred, waiting '%d' seconds before retry", int(e.value))
-				await asyncio.sleep(float(e.value))
+		# late progress edit must not overwrite delivered media caption
+		self.progress_aggregator.complete(chat_id, message_id)
+		peer = await self.client.resolve_peer(chat_id)
+		r = await self.send_scheduler.send(
+			chat_id,
+			self.client.invoke,
+			raw.functions.messages.EditMessage(
+				peer=peer,
+				id=message_id,
+				media=raw_media,
+				reply_markup=await reply_markup.write(self.client) if reply_markup else None,
+				message=message,
+				entities=entities
+			)
+		)
 
 		if r:
 			for i in r.updates:
@@ -1,15 +1,19 @@
+import os
 import logging
+import asyncio
 
 from pyrogram import Client
-from pyrogram.types import Message, CallbackQuery#, InlineKeyboardButton, InlineKeyboardMarkup
-from pyrogram.enums import ChatType, ParseMode
+from pyrogram.types import Message, CallbackQuery, ChatMemberUpdated#, InlineKeyboardButton, InlineKeyboardMarkup
+from pyrogram.enums import ChatType, ParseMode, ChatMemberStatus
 from pyrogram.types import BotCommand
-
-from urlextract import URLExtract
+from pyrogram.filters import Filter
 
 from warp_beacon.storage import Storage
 from warp_beacon.telegram.utils import Utils
 from warp_beacon.telegram.custom_handlers import CustomHandlers
+from warp_beacon.telegram.url_matcher import UrlMatcher
+from warp_beacon.telegram.chat_members_cache import ChatMembersCache
+from warp_beacon.jobs.abstract import AbstractJob
 from warp_beacon.jobs.download_job import DownloadJob
 from warp_beacon.jobs.upload_job import UploadJob
 from warp_beacon.jobs import Origin
@@ -19,12 +23,19 @@ from warp_beacon.scraper.link_resolver import LinkResolver
 class Handlers(object):
 	storage = None
 	bot = None
-	url_extractor = URLExtract()
 
 	def __init__(self, bot: "Bot") -> None:
 		self.bot = bot
-		self.storage = bot.storage
+		self.storage = bot.async_storage
 		self.custom_handlers = CustomHandlers()
+		self.flight_wait_timeout = int(os.environ.get("FLIGHT_WAIT_TIMEOUT", default=900))
+		self.flight_failed_msg = "Failed to download media. Please try again later."
+		self.waiting_tasks = set()
+		self.url_concurrency = int(os.environ.get("TG_URLS_CONCURRENCY", default=4))
+		self.members_cache = ChatMembersCache(
+			ttl=int(os.environ.get("TG_MEMBERS_CACHE_TTL", default=3600)),
+			max_size=int(os.environ.get("TG_MEMBERS_CACHE_SIZE", default=1000))
+		)
 
 	async def help(self, _: Client, message: Message) -> None:
 		"""Send a message when the command /help is issued."""
@@ -32,7 +43,7 @@ class Handlers(object):
 		#await message.reply_text("<code>test</code>\n<b>bold</b>\n<pre code=\"python\">print('hello')</pre> @BelisariusCawl", parse_mode=ParseMode.HTML)
 
 	async def random(self, _: Client, message: Message) -> None:
-		d = self.storage.get_random()
+		d = await self.storage.get_random()
 		if not d:
 			await message.reply_text("No random content yet. Try to send link first.")
 			return
@@ -68,15 +79,14 @@ class Handlers(object):
 		)
 
 	async def upload_wrapper(self, job: UploadJob) -> None:
+		tg_file_ids = []
 		try:
 			if job.replay:
 				logging.info("Replaying job with URL: '%s'", job.url)
 				return await self.queue_job(job.to_download_job(replay=False))
 
-			if job.job_failed and job.job_failed_msg:
-				if job.placeholder_message_id:
-					await self.bot.placeholder.remove(job.chat_id, job.placeholder_message_id)
-					return await self.bot.send_text(chat_id=job.chat_id, text=job.job_failed_msg, reply_id=job.message_id)
+			if job.job_failed:
+				return await self.notify_failed(job)
 								
 			if job.job_warning and job.job_warning_msg:
 				return await self.bot.placeholder.update_text(job.chat_id, job.placeholder_message_id, job.job_warning_msg)
@@ -86,7 +96,7 @@ class Handlers(object):
 				if job.media_type == JobType.COLLECTION and job.save_items:
 					for chunk in job.media_collection:
 						for i in chunk:
-							self.storage.add_media(
+							await self.storage.add_media(
 								tg_file_ids=[i.tg_file_id],
 								media_url=i.effective_url,
 								media_type=i.media_type.value,
@@ -98,7 +108,7 @@ class Handlers(object):
 					if not common_canonical_name and job.media_collection:
 						if job.media_collection[0]:
 							common_canonical_name = job.media_collection[0][0].canonical_name
-					self.storage.add_media(
+					await self.storage.add_media(
 						tg_file_ids=[','.join(tg_file_ids)],
 						media_url=job.url,
 						media_type=job.media_type.value,
@@ -106,7 +116,7 @@ class Handlers(object):
 						canonical_name=common_canonical_name
 					)
 				elif job.media_type == JobType.TEXT:
-					self.storage.add_media(
+					await self.storage.add_media(
 						tg_file_ids=[None],
 						media_url=job.url,
 						media_type=job.media_type.value,
@@ -114,7 +124,7 @@ class Handlers(object):
 						message_text=job.message_text
 					)
 				else:
-					self.storage.add_media(
+					await self.storage.add_media(
 						tg_file_ids=[','.join(tg_file_ids)],
 						media_url=job.url,
 						media_type=job.media_type.value,
@@ -124,8 +134,74 @@ class Handlers(object):
 		except Exception as e:
 			logging.error("Exception occurred while performing upload callback!")
 			logging.exception(e)
+		finally:
+			if not job.replay and not job.job_warning:
+				await self.release_flight(job, tg_file_ids)
+				await self.bot.journal.mark_done(job)
+
+	async def notify_failed(self, job: UploadJob) -> None:
+		if job.placeholder_message_id:
+			self.bot.progress_aggregator.complete(job.chat_id, job.placeholder_message_id)
+		if not job.job_failed_msg:
+			return
+		if job.placeholder_message_id:
+			await self.bot.placeholder.remove(job.chat_id, job.placeholder_message_id)
+		await self.bot.send_text(chat_id=job.chat_id, text=job.job_failed_msg, reply_id=job.message_id)
+
+	async def release_flight(self, job: AbstractJob, tg_file_ids: list[str]) -> None:
+		try:
+			# job which downloaded on its own after waiting timeout doesn't own the flight
+			if not self.bot.uploader.process_done(job.uniq_id, job.job_id):
+				return
+			result = {
+				"job_failed": job.job_failed,
+				"job_failed_msg": job.job_failed_msg,
+				"tg_file_ids": tg_file_ids,
+				"media_type": job.media_type,
+				"canonical_name": job.canonical_name,
+				"message_text": job.message_text
+			}
+			self.bot.uploader.notifier.notify(job.uniq_id, result)
+		except Exception as e:
+			logging.error("Failed to notify waiting chats!")
+			logging.exception(e)
+
+	async def wait_flight(self, job: DownloadJob, fut: asyncio.Future) -> None:
+		try:
+			result = await self.bot.uploader.notifier.wait(job.uniq_id, timeout=self.flight_wait_timeout, fut=fut)
+			if result is None:
+				logging.info("Downloading URL '%s' on our own", job.url)
+				# take over the flight if leader has gone meanwhile, otherwise flight state stays with the leader
+				self.bot.uploader.join_flight(job.uniq_id, job.job_id)
+				self.bot.fair_queue.submit(job)
+				return
+			if result["job_failed"]:
+				# leader's job may be parked for retry without message, waiter must get a reply anyway
+				await self.notify_failed(job.to_upload_job(
+					job_failed=True,
+					job_failed_msg=result["job_failed_msg"] or self.flight_failed_msg
+				))
+				await self.bot.journal.mark_done(job)
+				return
+			if not result["tg_file_ids"]:
+				# leader failed to upload, waiters elect new leader and try on their own
+				await self.queue_job(job, coalesce=True)
+				return
+			upload_args = {
+				"media_type": result["media_type"],
+				"canonical_name": result["canonical_name"],
+				"message_text": result["message_text"]
+			}
+			if result["media_type"] is not JobType.TEXT:
+				upload_args["tg_file_id"] = ','.join(result["tg_file_ids"])
+			await self.bot.upload_job(job.to_upload_job(**upload_args))
+			await self.bot.journal.mark_done(job)
+		except Exception as e:
+			logging.error("Failed to deliver media to waiting chat!")
+			logging.exception(e)
 
-	async def queue_job(self, job: DownloadJob) -> bool:
+	async def queue_job(self, job: DownloadJob, coalesce: bool = False) -> bool:
+		leader = False
 		try:
 			# create placeholder message for long download
 			if not job.placeholder_message_id:
@@ -141,14 +217,53 @@ class Handlers(object):
 					text="Failed to create message placeholder. Please check your bot Internet connection."
 				)
 
-			self.bot.downloader.queue_task(job)
+			await self.bot.journal.mark_queued(job)
+
+			# same media requested in other chat, wait for result of running download
+			if coalesce:
+				leader = self.bot.uploader.join_flight(job.uniq_id, job.job_id)
+			if coalesce and not leader:
+				logging.info("URL '%s' is already in work, waiting for the result", job.url)
+				fut = self.bot.uploader.notifier.subscribe(job.uniq_id)
+				task = asyncio.create_task(self.wait_flight(job, fut))
+				self.waiting_tasks.add(task)
+				task.add_done_callback(self.waiting_tasks.discard)
+				return True
+
+			position = self.bot.fair_queue.submit(job)
+			if position > 0:
+				await self.bot.placeholder.update_queue_position(job.chat_id, job.placeholder_message_id, position)
 		except Exception as e:
 			logging.error("Failed to schedule download task!")
 			logging.exception(e)
+			if leader:
+				# waiters elect new leader on empty result
+				await self.release_flight(job, [])
 			return False
 		
 		return True
 
+	async def replay_journal(self) -> None:
+		jobs = await self.bot.journal.replay()
+		if jobs:
+			logging.info("Replaying '%d' unfinished jobs from journal", len(jobs))
+		for job in jobs:
+			await self.queue_job(job, coalesce=True)
+
+	async def message_filter(self, _: Filter, __: Client, message: Message) -> bool:
+		"""Cheap check rejecting group chatter without supported links before handler is scheduled."""
+		if message is None:
+			return False
+		message_text = Utils.extract_message_text(message)
+		if not message_text:
+			return False
+		# custom handlers and private chat replies need every message
+		if self.custom_handlers.handlers:
+			return True
+		if message.chat and message.chat.type not in (ChatType.GROUP, ChatType.SUPERGROUP):
+			return True
+		return UrlMatcher.has_supported_url(message_text)
+
 	async def handler(self, client: Client, message: Message) -> None:
 		if message is None:
 			return
@@ -162,22 +277,18 @@ class Handlers(object):
 
 		chat = message.chat
 		effective_message_id = message.id
-		urls_raw = self.url_extractor.find_urls(message_text)
-		urls, msg_leftover = [], ''
-		if urls_raw:
-			msg_leftover = Utils.compute_leftover(urls_raw, message_text)
-			msg_leftover = await Utils.handle_mentions(chat.id, client, msg_leftover)
-			# remove duplicates
-			urls = list(set(urls_raw))
-			# remove links without paths
-			urls = Utils.remove_links_wo_paths(urls)
+		found_urls = UrlMatcher.extract(message_text)
+		msg_leftover = ''
+		if found_urls:
+			msg_leftover = Utils.compute_leftover([url for url, _ in found_urls], message_text)
+			msg_leftover = await Utils.handle_mentions(chat.id, client, msg_leftover, self.members_cache)
 
 		reply_text = "Wut?"
-		if not urls:
+		if not found_urls:
 			reply_text = "Your message should contain URLs"
 		else:
-			for url in urls:
-				origin = Utils.extract_origin(url)
+			links = {}
+			for url, origin in found_urls:
 				if origin is Origin.YOUTU_BE:
 					new_url = LinkResolver.extract_youtu_be_link_local(url)
 					if new_url:
@@ -185,75 +296,116 @@ class Handlers(object):
 						origin = Origin.YOUTUBE
 				if origin is Origin.INSTAGRAM:
 					url = Utils.remove_url_igsh(url)
-				if origin is Origin.UNKNOWN:
-					logging.info("Only Instagram, YouTube Shorts, YouTube Music and X are now supported. Skipping.")
-					continue
-				entities, tg_file_ids = [], []
-				uniq_id = Storage.compute_uniq(url)
 				try:
-					entities = self.storage.db_lookup_id(uniq_id)
-				except Exception as e:
-					logging.error("Failed to search link in DB!")
+					uniq_id = Storage.compute_uniq(url)
+				except ValueError as e:
+					logging.warning("Skipping URL '%s'", url)
 					logging.exception(e)
-				if entities:
-					tg_file_ids = [i["tg_file_id"] for i in entities]
-					logging.info("URL '%s' is found in DB. Sending with tg_file_ids = '%s'", url, str(tg_file_ids))
-					ent_len = len(entities)
-					if ent_len > 1:
-						await self.bot.upload_job(
-							UploadJob(
-								url=url,
-								uniq_id=uniq_id,
-								job_origin=origin,
-								tg_file_id=",".join(tg_file_ids),
-								message_id=effective_message_id,
-								media_type=JobType.COLLECTION,
-								chat_id=chat.id,
-								user_id=message.from_user.id,
-								chat_type=message.chat.type,
-								source_username=Utils.extract_message_author(message),
-								message_leftover=msg_leftover,
-								canonical_name=entities[0]["canonical_name"]
-							)
-						)
-					elif ent_len:
-						media_type = JobType[entities[0]["media_type"].upper()]
-						canonical_name = entities[0]["canonical_name"]
-						message_text = entities[0]["message_text"]
-						await self.bot.upload_job(
-							UploadJob(
-								url=url,
-								uniq_id=uniq_id,
-								job_origin=origin,
-								tg_file_id=tg_file_ids.pop(),
-								message_id=effective_message_id,
-								media_type=media_type,
-								chat_id=chat.id,
-								user_id=message.from_user.id,
-								chat_type=message.chat.type,
-								source_username=Utils.extract_message_author(message),
-								canonical_name=canonical_name,
-								message_leftover=msg_leftover,
-								message_text=message_text
-							)
+					continue
+				links.setdefault(uniq_id, (url, origin))
+
+			entities = {}
+			try:
+				entities = await self.storage.db_find_many(list(links.keys()))
+			except Exception as e:
+				logging.error("Failed to search links in DB!")
+				logging.exception(e)
+
+			semaphore = asyncio.Semaphore(self.url_concurrency)
+			async def bounded(coro) -> None:
+				async with semaphore:
+					await coro
+
+			await asyncio.gather(*(bounded(self.process_url(
+				message=message,
+				url=url,
+				origin=origin,
+				uniq_id=uniq_id,
+				entities=entities.get(uniq_id, []),
+				msg_leftover=msg_leftover
+			)) for uniq_id, (url, origin) in links.items()), return_exceptions=True)
+
+		if chat.type not in (ChatType.GROUP, ChatType.SUPERGROUP) and not found_urls:
+			if UrlMatcher.has_any_url(message_text):
+				logging.info("Only Instagram, YouTube Shorts, YouTube Music and X are now supported. Skipping.")
+			else:
+				await self.bot.send_text(text=reply_text, reply_id=effective_message_id, chat_id=chat.id)
+
+	async def process_url(self, message: Message, url: str, origin: Origin, uniq_id: str, entities: list[dict], msg_leftover: str) -> None:
+		try:
+			chat = message.chat
+			if entities:
+				tg_file_ids = [i["tg_file_id"] for i in entities]
+				logging.info("URL '%s' is found in DB. Sending with tg_file_ids = '%s'", url, str(tg_file_ids))
+				ent_len = len(entities)
+				if ent_len > 1:
+					await self.bot.upload_job(
+						UploadJob(
+							url=url,
+							uniq_id=uniq_id,
+							job_origin=origin,
+							tg_file_id=",".join(tg_file_ids),
+							message_id=message.id,
+							media_type=JobType.COLLECTION,
+							chat_id=chat.id,
+							user_id=message.from_user.id,
+							chat_type=chat.type,
+							source_username=Utils.extract_message_author(message),
+							message_leftover=msg_leftover,
+							canonical_name=entities[0]["canonical_name"]
 						)
+					)
 				else:
-					if await self.queue_job(DownloadJob.build(
-						url=url,
-						message_id=effective_message_id,
-						chat_id=chat.id,
-						user_id=message.from_user.id,
-						in_process=self.bot.uploader.is_inprocess(uniq_id),
-						uniq_id=uniq_id,
-						job_origin=origin,
-						source_username=Utils.extract_message_author(message),
-						chat_type=chat.type,
-						message_leftover=msg_leftover
-					)):
-						self.bot.uploader.set_inprocess(uniq_id)
-
-		if chat.type not in (ChatType.GROUP, ChatType.SUPERGROUP) and not urls:
-			await self.bot.send_text(text=reply_text, reply_id=effective_message_id, chat_id=chat.id)
+					media_type = JobType[entities[0]["media_type"].upper()]
+					canonical_name = entities[0]["canonical_name"]
+					message_text = entities[0]["message_text"]
+					await self.bot.upload_job(
+						UploadJob(
+							url=url,
+							uniq_id=uniq_id,
+							job_origin=origin,
+							tg_file_id=tg_file_ids.pop(),
+							message_id=message.id,
+							media_type=media_type,
+							chat_id=chat.id,
+							user_id=message.from_user.id,
+							chat_type=chat.type,
+							source_username=Utils.extract_message_author(message),
+							canonical_name=canonical_name,
+							message_leftover=msg_leftover,
+							message_text=message_text
+						)
+					)
+			else:
+				await self.queue_job(DownloadJob.build(
+					url=url,
+					message_id=message.id,
+					chat_id=chat.id,
+					user_id=message.from_user.id,
+					uniq_id=uniq_id,
+					job_origin=origin,
+					source_username=Utils.extract_message_author(message),
+					chat_type=chat.type,
+					message_leftover=msg_leftover
+				), coalesce=True)
+		except Exception as e:
+			logging.error("Failed to process URL '%s'!", url)
+			logging.exception(e)
+
+	async def chat_member_updated(self, client: Client, update: ChatMemberUpdated) -> None:
+		try:
+			member = update.new_chat_member or update.old_chat_member
+			if not member or not member.user:
+				return
+			if client.me and member.user.id == client.me.id:
+				# bot rights changed, rebuild index on next mention
+				self.members_cache.invalidate(update.chat.id)
+				return
+			is_member = update.new_chat_member is not None and update.new_chat_member.status not in (ChatMemberStatus.LEFT, ChatMemberStatus.BANNED)
+			self.members_cache.update_member(update.chat.id, member.user, is_member)
+		except Exception as e:
+			logging.warning("Failed to handle chat member update!")
+			logging.exception(e)
 
 	#TODO refactor to callback router
 	async def simple_button_handler(self, client: Client, query: CallbackQuery) -> None:
@@ -275,7 +427,7 @@ class Handlers(object):
 		logging.info("Handling read_more request: uniq_id='%s', origin='%s'", uniq_id, origin)
 		db_results = []
 		if uniq_id and origin:
-			db_results = self.storage.db_find(uniq_id=uniq_id.strip(), origin=origin.strip())
+			db_results = await self.storage.db_find(uniq_id=uniq_id.strip(), origin=origin.strip())
 		first_entity = {}
 		if db_results:
 			first_entity = db_results[0]
@@ -1,5 +1,5 @@
 import os, io
-import time
+import asyncio
 from enum import Enum
 from typing import Optional
 
@@ -9,6 +9,7 @@ from pyrogram.enums import ParseMode
 
 import warp_beacon
 from warp_beacon.telegram.utils import Utils
+from warp_beacon.telegram.send_scheduler import SendPriority
 #from warp_beacon.mediainfo.video import VideoInfo
 
 import logging
@@ -75,6 +76,7 @@ class PlaceholderMessage(object):
 		max_retries = int(os.environ.get("TG_MAX_RETRIES", default=5))
 		while not retry_amount >= max_retries:
 			try:
+				await self.bot.send_scheduler.acquire(chat_id, SendPriority.PLACEHOLDER)
 				text = "<b>Loading, this may take a moment ...</b> ⏱️ "
 				reply = None
 				if self.placeholder.tg_file_id is None:
@@ -146,15 +148,16 @@ class PlaceholderMessage(object):
 						reply = await self.reuse_ph_photo(chat_id, reply_id, text)
 				return reply.id
 			except FloodWait as e:
-				logging.warning("FloodWait exception!")
-				logging.exception(e)
-				await self.bot.send_text(None, "Telegram error: %s" % e.MESSAGE)
-				time.sleep(e.value)
+				# next attempt waits until the chat is released by scheduler
+				self.bot.send_scheduler.flood_wait(chat_id, e.value)
+				retry_amount += 1
+				if retry_amount < max_retries:
+					await self.bot.send_scheduler.wait_released(chat_id)
 			except Exception as e:
 				logging.error("Failed to create placeholder message!")
 				logging.exception(e)
 				retry_amount += 1
-				time.sleep(2)
+				await asyncio.sleep(2)
 
 		return 0
 
@@ -173,18 +176,38 @@ class PlaceholderMessage(object):
 		return bio
 
 	async def update_text(self, chat_id: int, placeholder_message_id: int, placeholder_text: str) -> None:
+		self.bot.progress_aggregator.complete(chat_id, placeholder_message_id)
 		try:
-			await self.bot.client.edit_message_caption(
+			await self.bot.send_scheduler.send(
+				chat_id,
+				self.bot.client.edit_message_caption,
 				chat_id=chat_id,
 				message_id=placeholder_message_id,
 				caption=" ⚠️ <b>%s</b>" % placeholder_text,
-				parse_mode=ParseMode.HTML
+				parse_mode=ParseMode.HTML,
+				priority=SendPriority.PLACEHOLDER
 			)
 		except Exception as e:
 			logging.error("Failed to update placeholder message!")
 			logging.exception(e)
 
+	async def update_queue_position(self, chat_id: int, placeholder_message_id: int, position: int) -> None:
+		try:
+			await self.bot.send_scheduler.send(
+				chat_id,
+				self.bot.client.edit_message_caption,
+				chat_id=chat_id,
+				message_id=placeholder_message_id,
+				caption="<b>Queued, %d request(s) ahead ...</b> ⏳" % position,
+				parse_mode=ParseMode.HTML,
+				priority=SendPriority.PROGRESS
+			)
+		except Exception as e:
+			logging.warning("Failed to show queue position!")
+			logging.exception(e)
+
 	async def remove(self, chat_id: int, placeholder_message_id: int) -> None:
+		self.bot.progress_aggregator.complete(chat_id, placeholder_message_id)
 		try:
 			await self.bot.client.delete_messages(chat_id, (placeholder_message_id,))
 		except Exception as e:
@@ -0,0 +1,121 @@
+import os
+import time
+import asyncio
+
+import logging
+
+from pyrogram import Client
+from pyrogram.enums import ParseMode
+from pyrogram.errors.exceptions.bad_request_400 import MessageNotModified
+
+from warp_beacon.telegram.send_scheduler import SendScheduler, SendPriority
+
+class ProgressAggregator(object):
+	'''
+		Keeps only the latest progress text per placeholder and edits caption
+		at most once per TG_PROGRESS_MIN_INTERVAL seconds per chat.
+		Intermediate updates are dropped, pending edit is cancelled when placeholder completes.
+		State of placeholders which never complete (e.g. failed or timed out jobs) expires after TG_PROGRESS_STATE_TTL seconds.
+	'''
+	def __init__(self, client: Client, send_scheduler: SendScheduler) -> None:
+		self.client = client
+		self.send_scheduler = send_scheduler
+		self.min_interval = float(os.environ.get("TG_PROGRESS_MIN_INTERVAL", default=3))
+		self.state_ttl = float(os.environ.get("TG_PROGRESS_STATE_TTL", default=3600))
+		# (chat_id, message_id) -> latest text not sent yet
+		self.latest = {}
+		# (chat_id, message_id) -> last sent text
+		self.rendered = {}
+		# (chat_id, message_id) -> TimerHandle or Task
+		self.pending = {}
+		# (chat_id, message_id) -> monotonic time of last update
+		self.touched = {}
+		# chat_id -> monotonic time when next edit in chat is allowed, reserved on scheduling
+		self.next_edit = {}
+		self.last_sweep = time.monotonic()
+
+	def update(self, chat_id: int | str, message_id: int, text: str) -> None:
+		key = (chat_id, message_id)
+		now = time.monotonic()
+		self.touched[key] = now
+		if now - self.last_sweep >= self.state_ttl:
+			self.sweep(now)
+		if self.rendered.get(key, None) == text:
+			self.latest.pop(key, None)
+			return
+		self.latest[key] = text
+		if key in self.pending:
+			# flush is already scheduled, it will take the latest text
+			return
+		self.schedule(key, now)
+
+	def schedule(self, key: tuple, now: float) -> None:
+		'''
+			Reserves the next free edit slot of chat, so placeholders of one chat are flushed one per interval.
+		'''
+		chat_id, _ = key
+		at = max(now, self.next_edit.get(chat_id, 0.0))
+		self.next_edit[chat_id] = at + self.min_interval
+		self.pending[key] = self.client.loop.call_later(at - now, self.flush, key)
+
+	def flush(self, key: tuple) -> None:
+		text = self.latest.pop(key, None)
+		if text is None:
+			self.pending.pop(key, None)
+			return
+		task = self.client.loop.create_task(self.edit(key, text))
+		self.pending[key] = task
+		task.add_done_callback(lambda _: self.on_edit_done(key, task))
+
+	async def edit(self, key: tuple, text: str) -> None:
+		chat_id, message_id = key
+		try:
+			result = await self.send_scheduler.send(
+				chat_id,
+				self.client.edit_message_caption,
+				chat_id, message_id, text, ParseMode.HTML,
+				priority=SendPriority.PROGRESS
+			)
+			if result is None:
+				# dropped on send timeout or flood wait, shown text is unknown
+				self.rendered.pop(key, None)
+				return
+			self.rendered[key] = text
+		except MessageNotModified:
+			self.rendered[key] = text
+		except Exception as e:
+			logging.warning("Failed to update progress of message '%s' in chat '%s'", message_id, chat_id)
+			logging.exception(e)
+
+	def on_edit_done(self, key: tuple, task: asyncio.Task) -> None:
+		if self.pending.get(key, None) is not task:
+			return
+		del self.pending[key]
+		if key in self.latest:
+			# updates came in while edit was in flight
+			self.schedule(key, time.monotonic())
+
+	def complete(self, chat_id: int | str, message_id: int) -> None:
+		'''
+			Must be called before the placeholder gets its final content,
+			so late progress edit does not overwrite it.
+		'''
+		key = (chat_id, message_id)
+		self.latest.pop(key, None)
+		self.rendered.pop(key, None)
+		self.touched.pop(key, None)
+		pending = self.pending.pop(key, None)
+		if pending is not None:
+			pending.cancel()
+		if self.next_edit.get(chat_id, 0.0) <= time.monotonic():
+			self.next_edit.pop(chat_id, None)
+
+	def sweep(self, now: float) -> None:
+		self.last_sweep = now
+		expired = [key for key, touched in self.touched.items() if now - touched >= self.state_ttl]
+		for chat_id, message_id in expired:
+			self.complete(chat_id, message_id)
+		for chat_id in [chat_id for chat_id, at in self.next_edit.items() if at <= now]:
+			del self.next_edit[chat_id]
+		if expired:
+			logging.info("Expired progress state of '%d' placeholders", len(expired))
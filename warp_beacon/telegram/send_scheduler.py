@@ -0,0 +1,215 @@
+import os
+import time
+import asyncio
+import itertools
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Optional
+
+import logging
+
+from pyrogram.errors import FloodWait
+
+class SendPriority(IntEnum):
+	DELIVERY = 0
+	PLACEHOLDER = 1
+	PROGRESS = 2
+
+class TokenBucket(object):
+	__slots__ = ("rate", "burst", "tokens", "updated", "paused_until")
+
+	def __init__(self, rate: float, burst: float, now: float) -> None:
+		self.rate = rate
+		self.burst = burst
+		self.tokens = burst
+		self.updated = now
+		self.paused_until = 0.0
+
+	def refill(self, now: float) -> None:
+		self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def delay(self, now: float, cost: float) -> float:
+		'''
+			Returns seconds to wait before cost tokens are available, 0 if they are.
+			Cost above burst is granted on full bucket, the balance goes negative and the debt delays next requests.
+		'''
+		if now < self.paused_until:
+			return self.paused_until - now
+		self.refill(now)
+		need = min(cost, self.burst)
+		if self.tokens >= need:
+			return 0.0
+		return (need - self.tokens) / self.rate
+
+	def take(self, cost: float) -> None:
+		self.tokens -= cost
+
+	def is_idle(self, now: float) -> bool:
+		self.refill(now)
+		return self.tokens >= self.burst and now >= self.paused_until
+
+class SendScheduler(object):
+	'''
+		Outbound requests of the bot pass this scheduler, which keeps them within global and per chat rate limits.
+		Requests are granted in priority order, user visible deliveries go before progress edits.
+		FloodWait pauses only the chat it was received for.
+		Progress edits which can't be sent for TG_PROGRESS_MAX_DELAY seconds are dropped.
+	'''
+	BUCKETS_PRUNE_INTERVAL = 60
+
+	def __init__(self) -> None:
+		self.global_rate = float(os.environ.get("TG_GLOBAL_RATE", default=30))
+		self.chat_rate = float(os.environ.get("TG_CHAT_RATE", default=1))
+		self.group_rate = float(os.environ.get("TG_GROUP_RATE", default=0.33))
+		self.chat_burst = float(os.environ.get("TG_CHAT_BURST", default=5))
+		self.progress_max_delay = float(os.environ.get("TG_PROGRESS_MAX_DELAY", default=5))
+		self.global_bucket = TokenBucket(self.global_rate, self.global_rate, time.monotonic())
+		self.chats = {}
+		# (priority, seq, chat_id, cost, future)
+		self.pending = []
+		self.seq = itertools.count()
+		self.wakeup = None
+		self.task = None
+		self.last_prune = time.monotonic()
+
+	def start(self) -> None:
+		self.wakeup = asyncio.Event()
+		self.task = asyncio.get_running_loop().create_task(self.dispatch())
+
+	async def stop(self) -> None:
+		if self.task is None:
+			return
+		self.task.cancel()
+		try:
+			await self.task
+		except asyncio.CancelledError:
+			pass
+		self.task = None
+		for item in self.pending:
+			if not item[4].done():
+				item[4].cancel()
+		self.pending.clear()
+
+	def chat_bucket(self, chat_id: int | str, now: float) -> TokenBucket:
+		bucket = self.chats.get(chat_id, None)
+		if bucket is None:
+			# groups, supergroups and channels have negative ids
+			rate = self.group_rate if isinstance(chat_id, int) and chat_id < 0 else self.chat_rate
+			bucket = TokenBucket(rate, self.chat_burst, now)
+			self.chats[chat_id] = bucket
+		return bucket
+
+	def flood_wait(self, chat_id: int | str, seconds: float) -> None:
+		logging.warning("FloodWait occurred, chat '%s' is paused for '%d' seconds", chat_id, int(seconds))
+		now = time.monotonic()
+		bucket = self.chat_bucket(chat_id, now)
+		bucket.paused_until = max(bucket.paused_until, now + float(seconds))
+		if self.wakeup:
+			self.wakeup.set()
+
+	async def wait_released(self, chat_id: int | str) -> None:
+		'''
+			Sleeps until FloodWait pause of chat is over, for callers which send out of scheduler.
+		'''
+		bucket = self.chats.get(chat_id, None)
+		if bucket is None:
+			return
+		delay = bucket.paused_until - time.monotonic()
+		if delay > 0:
+			await asyncio.sleep(delay)
+
+	def prune(self, now: float) -> None:
+		waiting = {item[2] for item in self.pending}
+		for chat_id in [k for k, v in self.chats.items() if k not in waiting and v.is_idle(now)]:
+			del self.chats[chat_id]
+		self.last_prune = now
+
+	def grant(self) -> Optional[float]:
+		'''
+			Grants tokens to pending requests in priority order.
+			Returns seconds until next request may be granted, None if nothing is pending.
+		'''
+		now = time.monotonic()
+		next_wait = None
+		remaining = []
+		global_blocked = False
+		for item in sorted(self.pending):
+			_, _, chat_id, cost, fut = item
+			if fut.done():
+				# waiter gave up
+				continue
+			if global_blocked:
+				remaining.append(item)
+				continue
+			bucket = self.chat_bucket(chat_id, now)
+			delay = bucket.delay(now, cost)
+			if not delay:
+				delay = self.global_bucket.delay(now, cost)
+				# lower priority requests must not take global tokens before this one
+				global_blocked = delay > 0
+			if delay:
+				remaining.append(item)
+				next_wait = delay if next_wait is None else min(next_wait, delay)
+				continue
+			bucket.take(cost)
+			self.global_bucket.take(cost)
+			fut.set_result(True)
+		self.pending = remaining
+		if now - self.last_prune >= self.BUCKETS_PRUNE_INTERVAL:
+			self.prune(now)
+		return next_wait
+
+	async def dispatch(self) -> None:
+		logging.info("Send scheduler started")
+		while True:
+			try:
+				next_wait = self.grant()
+				self.wakeup.clear()
+				try:
+					await asyncio.wait_for(self.wakeup.wait(), timeout=next_wait)
+				except asyncio.TimeoutError:
+					pass
+			except asyncio.CancelledError:
+				raise
+			except Exception as e:
+				logging.error("Exception occurred inside send scheduler!")
+				logging.exception(e)
+				await asyncio.sleep(1)
+
+	async def acquire(self, chat_id: int | str, priority: SendPriority = SendPriority.DELIVERY, cost: int = 1, timeout: float = None) -> bool:
+		if self.task is None:
+			return True
+		if not self.pending:
+			now = time.monotonic()
+			bucket = self.chat_bucket(chat_id, now)
+			if not bucket.delay(now, cost) and not self.global_bucket.delay(now, cost):
+				bucket.take(cost)
+				self.global_bucket.take(cost)
+				return True
+		fut = asyncio.get_running_loop().create_future()
+		self.pending.append((int(priority), next(self.seq), chat_id, cost, fut))
+		self.wakeup.set()
+		try:
+			await asyncio.wait_for(fut, timeout=timeout)
+			return True
+		except asyncio.TimeoutError:
+			return False
+
+	async def send(self, chat_id: int | str, func: Callable[..., Awaitable], *args, priority: SendPriority = SendPriority.DELIVERY, cost: int = 1, **kwargs) -> Any:
+		'''
+			Calls func when chat and global limits allow, repeats call after FloodWait.
+			Call is repeated with the same arguments, so high level send methods given local file path
+			upload it again, callers which have uploaded file already should pass raw InputFile or file_id.
+			Progress edits are not repeated, None is returned if they were dropped.
+		'''
+		timeout = self.progress_max_delay if priority == SendPriority.PROGRESS else None
+		while True:
+			if not await self.acquire(chat_id, priority, cost, timeout):
+				logging.debug("Dropped progress update for chat '%s'", chat_id)
+				return None
+			try:
+				return await func(*args, **kwargs)
+			except FloodWait as e:
+				self.flood_wait(chat_id, e.value)
+				if priority == SendPriority.PROGRESS:
+					return None
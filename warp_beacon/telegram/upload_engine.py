@@ -0,0 +1,113 @@
+import os
+import math
+import asyncio
+import inspect
+from typing import Callable
+
+import logging
+
+from pyrogram.client import Client
+from pyrogram.session import Session
+from pyrogram import raw
+
+class UploadEngine(object):
+	'''
+		Uploads big files with SaveBigFilePart over several media sessions at once.
+		Parts are read ahead into bounded queue, so memory use does not depend on file size.
+		Small files are left to client.save_file.
+	'''
+	PART_SIZE = 512 * 1024
+	BIG_FILE_SIZE = 10 * 1024 * 1024
+
+	def __init__(self, client: Client) -> None:
+		self.client = client
+		self.connections = max(1, int(os.environ.get("TG_UPLOAD_CONNECTIONS", default=4)))
+		self.workers_per_connection = max(1, int(os.environ.get("TG_UPLOAD_WORKERS_PER_CONNECTION", default=2)))
+		self.min_size = int(os.environ.get("TG_PARALLEL_UPLOAD_MIN_SIZE", default=self.BIG_FILE_SIZE))
+		self.part_retries = int(os.environ.get("TG_UPLOAD_PART_RETRIES", default=3))
+
+	async def save_file(self, path: str, progress: Callable = None, progress_args: tuple = ()) -> raw.base.InputFile:
+		file_size = os.path.getsize(path)
+		if file_size < max(self.min_size, self.BIG_FILE_SIZE) or self.connections == 1:
+			return await self.client.save_file(path=path, progress=progress, progress_args=progress_args)
+
+		file_id = self.client.rnd_id()
+		parts_count = math.ceil(file_size / self.PART_SIZE)
+		workers_count = self.connections * self.workers_per_connection
+		# memory bound: queued parts plus parts held by workers
+		queue = asyncio.Queue(maxsize=workers_count)
+		uploaded = 0
+
+		async def report(current: int) -> None:
+			if not progress:
+				return
+			if inspect.iscoroutinefunction(progress):
+				await progress(current, file_size, *progress_args)
+			else:
+				progress(current, file_size, *progress_args)
+
+		async def reader() -> None:
+			loop = asyncio.get_running_loop()
+			with open(path, "rb") as f:
+				for part_index in range(parts_count):
+					chunk = await loop.run_in_executor(None, f.read, self.PART_SIZE)
+					await queue.put((part_index, chunk))
+			for _ in range(workers_count):
+				await queue.put(None)
+
+		async def worker(session: Session) -> None:
+			nonlocal uploaded
+			while True:
+				item = await queue.get()
+				if item is None:
+					break
+				part_index, chunk = item
+				for attempt in range(1, self.part_retries + 1):
+					try:
+						await session.invoke(
+							raw.functions.upload.SaveBigFilePart(
+								file_id=file_id,
+								file_part=part_index,
+								file_total_parts=parts_count,
+								bytes=chunk
+							)
+						)
+						break
+					except Exception as e:
+						if attempt == self.part_retries:
+							raise
+						logging.warning("Failed to upload part '%d' of '%s', attempt '%d'", part_index, path, attempt)
+						logging.exception(e)
+						await asyncio.sleep(attempt)
+				uploaded += len(chunk)
+				await report(uploaded)
+
+		sessions = []
+		tasks = []
+		try:
+			dc_id = await self.client.storage.dc_id()
+			auth_key = await self.client.storage.auth_key()
+			test_mode = await self.client.storage.test_mode()
+			for _ in range(min(self.connections, parts_count)):
+				session = Session(self.client, dc_id, auth_key, test_mode, is_media=True)
+				await session.start()
+				sessions.append(session)
+
+			tasks.append(asyncio.create_task(reader()))
+			for i in range(workers_count):
+				tasks.append(asyncio.create_task(worker(sessions[i % len(sessions)])))
+			logging.info("Uploading '%s' in '%d' parts over '%d' connections", path, parts_count, len(sessions))
+			await asyncio.gather(*tasks)
+		finally:
+			for task in tasks:
+				if not task.done():
+					task.cancel()
+			await asyncio.gather(*tasks, return_exceptions=True)
+			for session in sessions:
+				try:
+					await session.stop()
+				except Exception as e:
+					logging.warning("Failed to stop upload session")
+					logging.exception(e)
+
+		return raw.types.InputFileBig(id=file_id, parts=parts_count, name=os.path.basename(path))
@@ -0,0 +1,154 @@
+import os
+import time
+from typing import Optional
+
+import logging
+
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+
+from warp_beacon.jobs.types import JobType
+from warp_beacon.jobs.upload_job import UploadJob
+from warp_beacon.telegram.progress_bar import ProgressBar
+from warp_beacon.telegram.progress_aggregator import ProgressAggregator
+from warp_beacon.telegram.types import ReportType
+from warp_beacon.telegram.utils import Utils
+
+class UploadShards(object):
+	'''
+		Helper bots which upload media into shared cache chat.
+		Main bot gets its own file_id of uploaded media and delivers it as cached one,
+		so upload bandwidth and flood limits are spread over several bot accounts.
+		Helper bots must be admins of TG_UPLOAD_CACHE_CHAT_ID, main bot must be its member.
+	'''
+	SHARDED_TYPES = (JobType.VIDEO, JobType.AUDIO, JobType.ANIMATION)
+
+	def __init__(self, main_client: Client, progress_aggregator: ProgressAggregator, tg_bot_name: str, tg_api_id: str, tg_api_hash: str) -> None:
+		self.main_client = main_client
+		self.progress_aggregator = progress_aggregator
+		self.cache_chat_id = int(os.environ.get("TG_UPLOAD_CACHE_CHAT_ID", default=0))
+		self.min_size = int(os.environ.get("TG_SHARD_UPLOAD_MIN_SIZE", default=5 * 1024 * 1024))
+		self.clients = []
+		tokens = [i.strip() for i in os.environ.get("TG_UPLOAD_BOT_TOKENS", default="").split(',') if i.strip()]
+		if tokens and not self.cache_chat_id:
+			logging.warning("TG_UPLOAD_BOT_TOKENS is set, but TG_UPLOAD_CACHE_CHAT_ID is not. Upload shards are disabled")
+			tokens = []
+		for i, token in enumerate(tokens):
+			self.clients.append(Client(
+				name=f"{tg_bot_name}_upload_{i}",
+				bot_token=token,
+				api_id=tg_api_id,
+				api_hash=tg_api_hash,
+				workdir='/var/warp_beacon',
+				no_updates=True
+			))
+		# bytes in progress and flood wait deadline per shard
+		self.pending_bytes = [0] * len(self.clients)
+		self.blocked_until = [0.0] * len(self.clients)
+		self.started = []
+
+	def is_enabled(self) -> bool:
+		return bool(self.started)
+
+	async def start(self) -> None:
+		for i, client in enumerate(self.clients):
+			try:
+				await client.start()
+				self.started.append(i)
+			except Exception as e:
+				logging.error("Failed to start upload shard #%d!", i)
+				logging.exception(e)
+		if self.started:
+			logging.info("Started '%d' upload shards", len(self.started))
+
+	async def stop(self) -> None:
+		for i in self.started:
+			try:
+				await self.clients[i].stop()
+			except Exception as e:
+				logging.warning("Failed to stop upload shard #%d", i)
+				logging.exception(e)
+		self.started.clear()
+
+	def should_shard(self, job: UploadJob) -> bool:
+		if not self.is_enabled() or job.tg_file_id or job.media_type not in self.SHARDED_TYPES:
+			return False
+		try:
+			return os.path.getsize(job.local_media_path) >= self.min_size
+		except OSError:
+			return False
+
+	def pick_shard(self, exclude: set) -> Optional[int]:
+		now = time.time()
+		candidates = [i for i in self.started if i not in exclude and self.blocked_until[i] <= now]
+		if not candidates:
+			return None
+		return min(candidates, key=lambda i: self.pending_bytes[i])
+
+	def build_args(self, job: UploadJob) -> dict:
+		args = {
+			"chat_id": self.cache_chat_id,
+			"file_name": os.path.basename(job.local_media_path),
+			"disable_notification": True
+		}
+		if job.media_type == JobType.VIDEO:
+			args["video"] = job.local_media_path
+			args["supports_streaming"] = True
+			args["width"] = job.media_info["width"]
+			args["height"] = job.media_info["height"]
+			args["duration"] = round(job.media_info["duration"])
+			args["thumb"] = job.media_info["thumb"]
+		elif job.media_type == JobType.AUDIO:
+			args["audio"] = job.local_media_path
+			args["performer"] = job.media_info["performer"]
+			args["thumb"] = job.media_info["thumb"]
+			args["duration"] = round(job.media_info["duration"])
+			args["title"] = job.canonical_name
+		elif job.media_type == JobType.ANIMATION:
+			args["animation"] = job.local_media_path
+			args["width"] = job.media_info["width"]
+			args["height"] = job.media_info["height"]
+			args["duration"] = round(job.media_info["duration"])
+			args["thumb"] = job.media_info["thumb"]
+		return args
+
+	async def upload(self, job: UploadJob) -> Optional[str]:
+		'''
+			Returns file_id valid for main bot, None if media has to be uploaded by main bot itself.
+		'''
+		file_size = os.path.getsize(job.local_media_path)
+		tried = set()
+		while True:
+			shard = self.pick_shard(tried)
+			if shard is None:
+				return None
+			tried.add(shard)
+			client = self.clients[shard]
+			send_funcs = {
+				JobType.VIDEO: client.send_video,
+				JobType.AUDIO: client.send_audio,
+				JobType.ANIMATION: client.send_animation
+			}
+			progress_args = {}
+			if job.placeholder_message_id:
+				progress_bar = ProgressBar(self.main_client, self.progress_aggregator)
+				progress_args["progress"] = progress_bar.progress_callback
+				progress_args["progress_args"] = (job.chat_id, job.placeholder_message_id, "Uploading", ReportType.PROGRESS, os.path.basename(job.local_media_path))
+			self.pending_bytes[shard] += file_size
+			try:
+				message = await send_funcs[job.media_type](**self.build_args(job), **progress_args)
+				# file_id is bound to bot, main bot has to read uploaded message by itself
+				main_message = await self.main_client.get_messages(self.cache_chat_id, message.id)
+				file_id = Utils.extract_file_id(main_message)
+				if file_id:
+					logging.info("Media '%s' uploaded by shard #%d", job.local_media_path, shard)
+					return file_id
+				logging.warning("Main bot can't see media uploaded by shard #%d", shard)
+			except FloodWait as e:
+				logging.warning("Upload shard #%d got FloodWait for '%d' seconds", shard, int(e.value))
+				self.blocked_until[shard] = time.time() + float(e.value)
+			except Exception as e:
+				logging.error("Upload shard #%d failed!", shard)
+				logging.exception(e)
+			finally:
+				self.pending_bytes[shard] -= file_size
@@ -0,0 +1,54 @@
+import re
+
+from warp_beacon.jobs import Origin
+from warp_beacon.telegram.utils import Utils
+
+class UrlMatcher(object):
+	'''
+		Extracts links of supported platforms only.
+		Much cheaper than generic URL extraction for chat messages without links.
+	'''
+	# substring test, rejects regular chatter without regex backtracking
+	# bare x.com must not match hosts like dropbox.com
+	prefilter_re = re.compile(r"instagram\.com/|youtube\.com/|youtu\.be/|(?<![A-Za-z0-9\-])x\.com/", re.IGNORECASE)
+	url_re = re.compile(
+		r"(?<![A-Za-z0-9.\-/@])(?:https?://)?(?:[A-Za-z0-9\-]+\.)*(?:instagram\.com|youtube\.com|youtu\.be|x\.com)/[^\s<>\"'`]*",
+		re.IGNORECASE
+	)
+	# any link with path, tells unsupported links from plain text
+	any_url_re = re.compile(r"(?<![A-Za-z0-9.\-/@])(?:https?://)?(?:[A-Za-z0-9\-]+\.)+[A-Za-z]{2,}/[^\s/<>\"'`]", re.IGNORECASE)
+	trailing_chars = ".,;:!?)]}'\"…»"
+
+	@staticmethod
+	def has_supported_url(text: str) -> bool:
+		return UrlMatcher.prefilter_re.search(text) is not None
+
+	@staticmethod
+	def has_any_url(text: str) -> bool:
+		return UrlMatcher.any_url_re.search(text) is not None
+
+	@staticmethod
+	def find_urls(text: str) -> list[str]:
+		if not UrlMatcher.has_supported_url(text):
+			return []
+		urls = []
+		for match in UrlMatcher.url_re.finditer(text):
+			url = match.group(0).rstrip(UrlMatcher.trailing_chars)
+			if url:
+				urls.append(url)
+		return urls
+
+	@staticmethod
+	def extract(text: str) -> list[tuple[str, Origin]]:
+		'''
+			Returns unique (url, origin) pairs of supported links with path.
+		'''
+		ret, seen = [], set()
+		for url in Utils.remove_links_wo_paths(UrlMatcher.find_urls(text)):
+			if url in seen:
+				continue
+			seen.add(url)
+			origin = Utils.extract_origin(url)
+			if origin is not Origin.UNKNOWN:
+				ret.append((url, origin))
+		return ret
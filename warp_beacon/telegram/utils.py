@@ -108,43 +108,23 @@ class Utils(object):
 		return ret
 
 	@staticmethod
-	async def handle_mentions(chat_id: int, client: Client, message: str) -> str:
+	async def handle_mentions(chat_id: int, client: Client, message: str, members_cache: "ChatMembersCache") -> str:
 		try:
 			mentions = Utils.mention_re.findall(message)
 			if not mentions:
 				return message
 
-			logging.info("Processing chat_id: '%s'", str(chat_id))
-			chat = await client.get_chat(chat_id)
-			chat_id = chat.id
-
-			chat_member = await client.get_chat_member(chat_id, client.me.id)
-			if chat_member.status not in (enums.ChatMemberStatus.ADMINISTRATOR, enums.ChatMemberStatus.OWNER):
+			index = await members_cache.get_index(client, chat_id)
+			if not index.is_admin:
 				logging.warning("Bot is not an admin in this channel!")
 				return message
 
-			username = ''
-			members = [member async for member in client.get_chat_members(chat_id)]
 			for mention in mentions:
 				username = mention[1:].strip()
 				if username:
-					user_id = None
-					display_name = username
-
-					for member in members:
-						if member.user.username and member.user.username.lower() == username.lower():
-							user_id = member.user.id
-							display_name = member.user.first_name or member.user.last_name or username
-							break
-
-					if user_id is None:
-						for member in members:
-							if member.user.first_name and member.user.first_name.lower() == username.lower():
-								user_id = member.user.id
-								display_name = member.user.first_name
-								break
-
-					if user_id:
+					member = index.find(username)
+					if member:
+						user_id, display_name = member
 						message = message.replace(f"@{username}", f'<a href="tg://user?id={user_id}">{display_name}</a>')
 		except Exception as e:
 			logging.warning("Exception occurred while handling TG mentions!")
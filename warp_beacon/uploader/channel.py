@@ -0,0 +1,98 @@
+import pickle
+import asyncio
+import threading
+import multiprocessing
+from typing import Callable
+
+import logging
+
+class ProcessChannel(object):
+	'''
+		One way channel from worker processes to the event loop.
+		Messages are length framed and written under inter-process lock, so concurrent producers never interleave.
+		Readable end is registered with loop.add_reader and drained in batches, so no threads are spent on waiting.
+		Reading may be paused, then writers block on full pipe, what gives backpressure to producers.
+		Producers must not live in the event loop thread.
+	'''
+	def __init__(self) -> None:
+		self.reader, self.writer = multiprocessing.Pipe(duplex=False)
+		# pipe writes longer than PIPE_BUF are not atomic
+		self.write_lock = multiprocessing.Lock()
+		self.loop = None
+		self.callback = None
+		self.reading = False
+		self.draining = False
+		self.batch_size = 64
+
+	def send_bytes(self, data: bytes) -> None:
+		with self.write_lock:
+			self.writer.send_bytes(data)
+
+	def send(self, obj: object) -> None:
+		self.send_bytes(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+	def attach(self, loop: asyncio.AbstractEventLoop, callback: Callable[[bytes], None], batch_size: int = 64) -> None:
+		self.loop = loop
+		self.callback = callback
+		self.batch_size = batch_size
+		self.resume()
+
+	def resume(self) -> None:
+		if self.reading or self.draining or self.loop is None:
+			return
+		self.reading = True
+		self.loop.add_reader(self.reader.fileno(), self.on_readable)
+
+	def pause(self) -> None:
+		if not self.reading:
+			return
+		self.reading = False
+		self.loop.remove_reader(self.reader.fileno())
+
+	def on_readable(self) -> None:
+		for _ in range(self.batch_size):
+			if not self.reading or not self.reader.poll():
+				break
+			try:
+				data = self.reader.recv_bytes()
+			except EOFError:
+				self.pause()
+				break
+			try:
+				self.callback(data)
+			except Exception as e:
+				logging.error("Exception occurred inside channel callback!")
+				logging.exception(e)
+
+	def drain(self) -> None:
+		'''
+			Detaches channel from the loop and discards messages until all writers are gone,
+			so producers blocked on full pipe are able to exit.
+		'''
+		if self.draining:
+			return
+		self.draining = True
+		if self.reading:
+			self.reading = False
+			try:
+				if asyncio.get_running_loop() is self.loop:
+					self.loop.remove_reader(self.reader.fileno())
+				else:
+					self.loop.call_soon_threadsafe(self.loop.remove_reader, self.reader.fileno())
+			except RuntimeError:
+				if not self.loop.is_closed():
+					self.loop.call_soon_threadsafe(self.loop.remove_reader, self.reader.fileno())
+		self.writer.close()
+		thread = threading.Thread(target=self.discard, daemon=True)
+		thread.start()
+
+	def discard(self) -> None:
+		discarded = 0
+		while True:
+			try:
+				self.reader.recv_bytes()
+				discarded += 1
+			except (EOFError, OSError):
+				break
+		if discarded:
+			logging.info("Discarded '%d' messages on channel shutdown", discarded)
@@ -0,0 +1,52 @@
+import asyncio
+from typing import Optional
+
+import logging
+
+class CompletionNotifier(object):
+	'''
+		Wakes coroutines waiting for the media of some uniq_id.
+		Must be used from the event loop thread only.
+	'''
+	def __init__(self) -> None:
+		self.subscribers = {}
+
+	def subscribe(self, uniq_id: str) -> asyncio.Future:
+		fut = asyncio.get_running_loop().create_future()
+		self.subscribers.setdefault(uniq_id, []).append(fut)
+		return fut
+
+	def unsubscribe(self, uniq_id: str, fut: asyncio.Future) -> None:
+		futures = self.subscribers.get(uniq_id, [])
+		if fut in futures:
+			futures.remove(fut)
+		if not futures:
+			self.subscribers.pop(uniq_id, None)
+
+	def has_subscribers(self, uniq_id: str) -> bool:
+		return bool(self.subscribers.get(uniq_id, None))
+
+	def notify(self, uniq_id: str, result: dict) -> int:
+		futures = self.subscribers.pop(uniq_id, [])
+		for fut in futures:
+			if not fut.done():
+				fut.set_result(result)
+		if futures:
+			logging.info("Notified '%d' waiter(s) of '%s'", len(futures), uniq_id)
+		return len(futures)
+
+	async def wait(self, uniq_id: str, timeout: float, fut: Optional[asyncio.Future] = None) -> Optional[dict]:
+		'''
+			Pass future obtained by subscribe() if subscription has to be made
+			before the caller yields to event loop, otherwise notification can be missed.
+		'''
+		if fut is None:
+			fut = self.subscribe(uniq_id)
+		try:
+			return await asyncio.wait_for(fut, timeout=timeout)
+		except asyncio.TimeoutError:
+			logging.warning("Waiting for '%s' timed out after '%d' seconds", uniq_id, int(timeout))
+		finally:
+			self.unsubscribe(uniq_id, fut)
+
+		return None